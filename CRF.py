@@ -19,3 +19,16 @@ class CRF:
     ## --------------------------------------------------
     def predict(self, xseq):
         return self.tagger.tag(xseq)
+
+## --------------------------------------------------
+## Train a CRF on given (xseq,yseq) instances, with given
+## algorithm and parameters, and write it to modelfile
+## --------------------------------------------------
+def train(instances, modelfile, algorithm="l2sgd", params={}, verbose=False):
+    trainer = pycrfsuite.Trainer(verbose=verbose)
+    for xseq, yseq in instances:
+        trainer.append(xseq, yseq, 0)
+    trainer.select(algorithm, 'crf1d')
+    for name, value in params.items():
+        trainer.set(name, value)
+    trainer.train(modelfile, -1)
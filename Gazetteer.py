@@ -0,0 +1,130 @@
+#####################################################
+## Class to match DrugBank names in tokenized sentences
+#####################################################
+
+import os
+import pickle
+import tempfile
+from collections import deque
+
+# version of the Gazetteer class, to be changed whenever its attributes
+# change (it is part of the key of compiled copies, see load)
+VERSION = "1"
+
+class Gazetteer:
+
+    ## --------------------------------------------------
+    ## Constructor: Aho-Corasick automaton over the token sequences
+    ## of all names in given Lexicon, tokenized with given tokenizer
+    ## (the one used for sentences, so that names and sentences are
+    ## split alike).  Node 0 is the root, and for each node:
+    ##    goto[node] : word -> next node
+    ##    fail[node] : node for the longest proper suffix in the trie
+    ##    out[node]  : (type, length) of the names ending there
+    ## --------------------------------------------------
+    def __init__(self, lexicon, tokenize):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+        for kind in lexicon.kinds:
+            for name in sorted(lexicon.names[kind]):
+                words = [w for (w, start, end) in tokenize(name)]
+                if not words:
+                    continue
+                node = 0
+                for w in words:
+                    if w not in self.goto[node]:
+                        self.goto[node][w] = len(self.goto)
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.out.append([])
+                    node = self.goto[node][w]
+                if (kind, len(words)) not in self.out[node]:
+                    self.out[node].append((kind, len(words)))
+
+        # failure links, breadth first. Outputs of the failure node
+        # are added to each node, so that matching needs no output links
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for w, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and w not in self.goto[f]:
+                    f = self.fail[f]
+                if w in self.goto[f]:
+                    self.fail[child] = self.goto[f][w]
+                self.out[child] = self.out[child] + [o for o in self.out[self.fail[child]] if o not in self.out[child]]
+
+    ## --------------------------------------------------
+    ## (start, end, type) of all names found in given list of
+    ## lowercased words, with end not included. One pass over
+    ## the sentence.
+    ## --------------------------------------------------
+    def matches(self, words):
+        (goto, fail, out) = (self.goto, self.fail, self.out)
+        found = []
+        node = 0
+        for i, w in enumerate(words):
+            while node and w not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(w, 0)
+            for (kind, length) in out[node]:
+                found.append((i-length+1, i+1, kind))
+        return found
+
+    ## --------------------------------------------------
+    ## BIO gazetteer features for each token form in a sentence:
+    ## "gaz<type>=B" for the first token of a matched name of that
+    ## type, "gaz<type>=I" for the rest of its tokens
+    ## --------------------------------------------------
+    def features(self, forms):
+        feats = [[] for f in forms]
+        for (start, end, kind) in self.matches([f.lower() for f in forms]):
+            for k in range(start, end):
+                f = "gaz" + kind + ("=B" if k == start else "=I")
+                if f not in feats[k]:
+                    feats[k].append(f)
+        return feats
+
+    ## --------------------------------------------------
+    ## Gazetteer for given Lexicon (loaded from datafile, see
+    ## Lexicon.load) and tokenizer name, going through a compiled
+    ## copy stored next to datafile (datafile+"."+tokenizer+".gaz"),
+    ## rebuilt when the lexicon (or the Lexicon or Gazetteer VERSION)
+    ## changes, or when it cannot be read
+    ## --------------------------------------------------
+    @staticmethod
+    def load(lexicon, datafile, tokenizer):
+        import Lexicon
+        from tokenizer import TOKENIZERS
+
+        key = "|".join([VERSION, Lexicon.VERSION, lexicon.digest])
+        cachefile = datafile + "." + tokenizer + ".gaz"
+        try:
+            with open(cachefile, "rb") as f:
+                if pickle.load(f) == key:
+                    return pickle.load(f)
+        except Exception:
+            # missing, truncated, or pickled from an older Gazetteer
+            pass
+
+        gazetteer = Gazetteer(lexicon, TOKENIZERS[tokenizer])
+
+        # write to a temporary file and rename, as in Lexicon.load
+        try:
+            (fd, tmpfile) = tempfile.mkstemp(dir=os.path.dirname(cachefile) or ".")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                    pickle.dump(gazetteer, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpfile, cachefile)
+            except BaseException:
+                # interrupted or failed: leave no temporary file behind
+                os.unlink(tmpfile)
+                raise
+        except OSError:
+            pass
+
+        return gazetteer
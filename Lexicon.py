@@ -0,0 +1,93 @@
+#####################################################
+## Class to store the DrugBank lexicon
+#####################################################
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+# version of the Lexicon class, to be changed whenever its attributes
+# change (it is part of the key of compiled copies, see load)
+VERSION = "1"
+
+class Lexicon:
+
+    ## --------------------------------------------------
+    ## Constructor: Load lexicon from DrugBank file
+    ## --------------------------------------------------
+    def __init__(self, datafile):
+        self.kinds = []   # entity types, in order of first appearance in the file
+        self.names = {}   # type -> set of known (lowercased) names
+        self.words = {}   # word -> set of types having some name containing that word
+
+        with open(datafile, encoding="utf-8") as f:
+            for d in f:
+                (t, c) = d.strip().lower().split("|")
+                if c not in self.names:
+                    self.kinds.append(c)
+                    self.names[c] = set()
+                self.names[c].add(t)
+                for w in t.split():
+                    if w not in self.words:
+                        self.words[w] = set()
+                    self.words[w].add(c)
+
+    ## --------------------------------------------------
+    ## Check whether (lowercased) token t is a known name of given
+    ## type ("True"), a word inside a known name ("Partial"),
+    ## or neither ("False")
+    ## --------------------------------------------------
+    def match(self, t, kind):
+        if t in self.names[kind]:
+            return "True"
+        elif kind in self.words.get(t, ()):
+            return "Partial"
+        else:
+            return "False"
+
+    ## --------------------------------------------------
+    ## Load lexicon from DrugBank file, going through a compiled
+    ## copy stored next to it (datafile+".lex").  The compiled copy
+    ## is keyed by VERSION and the hash of datafile, and rebuilt when
+    ## either changes, or when it cannot be read.  The hash is kept in
+    ## lexicon.digest
+    ## --------------------------------------------------
+    @staticmethod
+    def load(datafile):
+        with open(datafile, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        key = VERSION + "|" + digest
+
+        cachefile = datafile + ".lex"
+        try:
+            with open(cachefile, "rb") as f:
+                if pickle.load(f) == key:
+                    lexicon = pickle.load(f)
+                    lexicon.digest = digest
+                    return lexicon
+        except Exception:
+            # missing, truncated, or pickled from an older Lexicon
+            pass
+
+        lexicon = Lexicon(datafile)
+
+        # write to a temporary file and rename, so that concurrent
+        # processes never see a half-written cache.  If the directory
+        # is not writable, just go on without cache.
+        try:
+            (fd, tmpfile) = tempfile.mkstemp(dir=os.path.dirname(cachefile) or ".")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+                    pickle.dump(lexicon, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpfile, cachefile)
+            except BaseException:
+                # interrupted or failed: leave no temporary file behind
+                os.unlink(tmpfile)
+                raise
+        except OSError:
+            pass
+
+        lexicon.digest = digest
+        return lexicon
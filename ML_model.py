@@ -1,27 +1,92 @@
 
-from CRF import *
+import importlib
+
+## --------------------------------------------------
+## Registry of model backends: file extension -> (module, class).
+## Backend modules (and the libraries they need) are only
+## imported when a model of their type is loaded.
+## --------------------------------------------------
+
+BACKENDS = { ".crf" : ("CRF", "CRF"),
+             ".joblib" : ("NB", "NB") }
+
+def register(extension, module, classname):
+    BACKENDS[extension] = (module, classname)
+
 
 class ML_model:
 
     ## --------------------------------------------------
-    ## Constructor: Load model from file
+    ## Constructor: Load model from file, with the backend
+    ## registered for its extension. Options are passed to
+    ## the backend (e.g. vectorizer file for NB models)
     ## --------------------------------------------------
 
-    def __init__(self, datafile):
+    def __init__(self, datafile, **options):
 
-        if datafile[-4:]==".crf" :
-            # load CRF model
-            self._model = CRF(datafile)
+        for extension, (module, classname) in BACKENDS.items() :
+            if datafile.endswith(extension) :
+                backend = getattr(importlib.import_module(module), classname)
+                self._model = backend(datafile, **options)
+                break
 
         else:
-            print("Unknown model type",datafile[-3:])
-            exit()
+            raise ValueError("Unknown model type "+datafile)
 
     ## --------------------------------------------------
     ## Call predictor on a sequence
     ## --------------------------------------------------
-            
+
     def predict(self, xseq) :
         return self._model.predict(xseq)
 
+    ## --------------------------------------------------
+    ## Call predictor on a list of sequences. Backends that
+    ## can do better than one sequence at a time provide
+    ## their own predict_batch
+    ## --------------------------------------------------
+
+    def predict_batch(self, xseqs) :
+        if hasattr(self._model, "predict_batch") :
+            return self._model.predict_batch(xseqs)
+        return [self._model.predict(xseq) for xseq in xseqs]
+
+
+## --------------------------------------------------
+## Entities in BIO predictions for a sentence, as a list of
+## (first, last, type) token positions
+## --------------------------------------------------
+
+def decode_spans(predictions):
+    spans = []
+    inside = False;
+    for k in range(0,len(predictions)) :
+        y = predictions[k]
+
+        if (y[0]=="B") :	# If predicted B --> Save start and type
+            first = k
+            last = k
+            entity_type = y[2:]
+            inside = True
+        elif (y[0]=="I" and inside) : # If predicted I --> Extend entity
+            last = k
+        elif (y[0]=="O" and inside) : # If predicted O but was in insede --> Save result and set insede=F
+            spans.append((first, last, entity_type))
+            inside = False
+
+    if inside : spans.append((first, last, entity_type))
+    return spans
+
+
+## --------------------------------------------------
+## Convert BIO predictions for a sentence into entities.  Returns a
+## list of (sid, "start-end", form, type) tuples
+## --------------------------------------------------
 
+def decode(toks, predictions):
+    entities = []
+    for (first, last, entity_type) in decode_spans(predictions) :
+        (sid, form, offS, offE) = toks[first]
+        entity_form = " ".join(toks[k][1] for k in range(first, last+1))
+        entities.append((sid, offS+"-"+toks[last][3], entity_form, entity_type))
+    return entities
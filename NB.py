@@ -0,0 +1,76 @@
+#####################################################
+## Class to store a sklearn (Naive Bayes) token classifier
+#####################################################
+
+import os
+from joblib import load
+
+import profiler
+
+
+## --------------------------------------------------
+## Feature dictionary for a token (list of "name=value" features),
+## in the format the vectorizer was fitted with by train-sklearn.py
+## --------------------------------------------------
+
+def fix_format(token):
+    if 'BoS' in token:
+        token = token.replace('BoS','formPrev=BoS\tsuf3Prev=BoS')
+    if 'EoS' in token:
+        token = token.replace('EoS','formNext=EoS\tsuf3Next=EoS')
+    return token
+
+def token_dict(token):
+    # Same dictionary as fix_format+split on the whole token, but only
+    # features containing BoS/EoS go through the string replacement
+    feats = []
+    for feat in token:
+        if 'BoS' in feat or 'EoS' in feat:
+            feats.extend(fix_format(feat).split('\t'))
+        else:
+            feats.append(feat)
+    token_dict = {}
+    for feat in feats[1:]:
+        kv = feat.split('=')
+        token_dict[kv[0]] = kv[1]
+    return token_dict
+
+
+class NB:
+
+    ## --------------------------------------------------
+    ## Constructor: Load model and vectorizer from files. By default,
+    ## the vectorizer is vectorizer.joblib, next to the model
+    ## --------------------------------------------------
+    def __init__(self, datafile, vectorizer=None):
+        if vectorizer is None:
+            vectorizer = os.path.join(os.path.dirname(datafile), "vectorizer.joblib")
+        self.model = load(datafile)
+        self.vectorizer = load(vectorizer)
+
+    ## --------------------------------------------------
+    ## predict best class for each element in xseq
+    ## --------------------------------------------------
+    def predict(self, xseq):
+        return self.predict_batch([xseq])[0]
+
+    ## --------------------------------------------------
+    ## predict all tokens of given sequences at once, and
+    ## slice the predictions back for each sequence
+    ## --------------------------------------------------
+    def predict_batch(self, xseqs):
+        with profiler.timer("prepare"):
+            tokens = [token_dict(token) for xseq in xseqs for token in xseq]
+        if not tokens:
+            return [[] for xseq in xseqs]
+        with profiler.timer("vectorize"):
+            vectors = self.vectorizer.transform(tokens)
+        with profiler.timer("predict"):
+            predictions = self.model.predict(vectors)
+
+        result = []
+        offset = 0
+        for xseq in xseqs:
+            result.append(list(predictions[offset:offset+len(xseq)]))
+            offset += len(xseq)
+        return result
@@ -0,0 +1,75 @@
+#####################################################
+## Class to tag raw sentences in memory
+#####################################################
+
+import features
+from Lexicon import Lexicon
+from tokenizer import TOKENIZERS
+from ML_model import ML_model, decode_spans
+
+class NERPipeline:
+
+    ## --------------------------------------------------
+    ## Constructor: Load the model (any type known to ML_model, with
+    ## its options, e.g. vectorizer), and the resources to featurize
+    ## sentences as extract-features.py does with the same options
+    ## (tokenizer, all_groups, gazetteer).  groups and exclude_groups
+    ## select feature groups as the train/predict scripts do.
+    ## --------------------------------------------------
+    def __init__(self, modelfile, drugbank, tokenizer="nltk", all_groups=False, gazetteer=False,
+                 groups=None, exclude_groups=None, batch_size=200, **options):
+        self.model = ML_model(modelfile, **options)
+        self.lexicon = Lexicon.load(drugbank)
+        self.tokenize = TOKENIZERS[tokenizer]
+        self.all_groups = all_groups
+        self.gazetteer = None
+        if gazetteer:
+            from Gazetteer import Gazetteer
+            self.gazetteer = Gazetteer.load(self.lexicon, drugbank, tokenizer)
+        self.select = features.group_filter(groups, exclude_groups)
+        self.batch_size = batch_size
+
+    ## --------------------------------------------------
+    ## The feature extractor settings are module globals in features.py.
+    ## Set them to this pipeline's, if some other user changed them.
+    ## --------------------------------------------------
+    def activate(self):
+        if features.lookupDrugs is not self.lexicon:
+            features.set_lexicon(self.lexicon)
+        if features.allGroups != self.all_groups:
+            features.set_all_groups(self.all_groups)
+        if features.gazetteer is not self.gazetteer:
+            features.set_gazetteer(self.gazetteer)
+
+    ## --------------------------------------------------
+    ## Entities in each of given texts, as a list (one per text) of
+    ## (start, end, text, type) tuples, with character offsets of the
+    ## first and last characters of the entity (as in DDI XML files).
+    ## Texts are tagged in batches of batch_size sentences.
+    ## --------------------------------------------------
+    def tag(self, texts):
+        self.activate()
+        texts = list(texts)
+        result = []
+        for b in range(0, len(texts), self.batch_size):
+            result.extend(self.tag_batch(texts[b:b+self.batch_size]))
+        return result
+
+    def tag_batch(self, texts):
+        sentences = [self.tokenize(text) for text in texts]
+        features.prepare([tk[0] for tokens in sentences for tk in tokens])
+        xseqs = []
+        for tokens in sentences:
+            xseq = features.extract_features(tokens)
+            xseqs.append(self.select(xseq) if self.select else xseq)
+
+        tagged = [k for k in range(len(texts)) if sentences[k]]
+        predictions = self.model.predict_batch([xseqs[k] for k in tagged])
+
+        result = [[] for text in texts]
+        for k, y in zip(tagged, predictions):
+            (text, tokens) = (texts[k], sentences[k])
+            for (first, last, entity_type) in decode_spans(y):
+                (start, end) = (tokens[first][1], tokens[last][2])
+                result[k].append((start, end, text[start:end+1], entity_type))
+        return result
@@ -0,0 +1,73 @@
+#! /usr/bin/python3
+
+import sys
+import time
+
+from corpus import read_corpus
+from tokenizer import tokenize_nltk, tokenize_regex
+
+
+## --
+## -- Tokenize all sentences with given tokenizer, 'repeat' times,
+## -- and return the tokens of the last run and the best time.
+## --
+
+def run(tokenizer, texts, repeat) :
+    best = None
+    for r in range(repeat) :
+        start = time.perf_counter()
+        tokens = [tokenizer(t) for t in texts]
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best : best = elapsed
+    return tokens, best
+
+
+def row(txt) :
+   return txt + ' '*(17-len(txt))
+
+
+## --------- MAIN PROGRAM ----------- 
+## --
+## -- Usage:  bench-tokenizer.py datadir [repeat]
+## --
+## -- Compares speed and token agreement of the nltk and regex
+## -- tokenizers on all sentences of the XML files in datadir.
+## -- Agreement is measured on (start,end) spans, taking nltk as reference.
+## --
+
+if __name__ == "__main__":
+
+    if len(sys.argv) < 2 :
+        print("\n  Usage: bench-tokenizer.py datadir [repeat]\n")
+        exit()
+
+    datadir = sys.argv[1]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    texts = [stext for (sid, stext, entities, pairs) in read_corpus(datadir)]
+    tokenize_nltk("warm up")  # do not count nltk import time
+
+    (ref, tnltk) = run(tokenize_nltk, texts, repeat)
+    (hyp, tregex) = run(tokenize_regex, texts, repeat)
+
+    (nref, nsys, common, same) = (0, 0, 0, 0)
+    for (r, s) in zip(ref, hyp) :
+        rspans = set((start, end) for (w, start, end) in r)
+        sspans = set((start, end) for (w, start, end) in s)
+        nref += len(rspans)
+        nsys += len(sspans)
+        common += len(rspans & sspans)
+        if rspans == sspans : same += 1
+
+    ntok = sum(len(r) for r in ref)
+    print(row("sentences")+"{:>10}".format(len(texts)))
+    print("------------------------------------------------")
+    print(row("nltk")+"{:>10.3f} s\t{:>10.0f} tokens/s".format(tnltk, ntok/tnltk if tnltk else 0))
+    print(row("regex")+"{:>10.3f} s\t{:>10.0f} tokens/s".format(tregex, ntok/tregex if tregex else 0))
+    print(row("speedup")+"{:>10.1f}x".format(tnltk/tregex if tregex else 0))
+    print("------------------------------------------------")
+    P = common/nsys if nsys else 0
+    R = common/nref if nref else 0
+    print(row("span precision")+"{:>10.1%}".format(P))
+    print(row("span recall")+"{:>10.1%}".format(R))
+    print(row("same sentences")+"{:>10.1%}".format(same/len(texts) if texts else 0))
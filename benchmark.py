@@ -0,0 +1,383 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import traceback
+import subprocess
+import importlib.util
+from xml.sax.saxutils import quoteattr
+
+## --
+## -- Benchmark suite for the pipeline stages: tokenization and
+## -- featurization (tokens/s), CRF and NB training (wall time) and
+## -- prediction (sentences/s), and evaluation (wall time).
+## --
+## -- Each stage runs in its own child process (forked, or the stage
+## -- script itself), so that the peak RSS reported for it is the one
+## -- of that stage alone.  The parent only imports standard modules.
+## --
+
+CODEDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+## --
+## -- Synthetic DDI corpus: XML files in data/train and data/devel, and
+## -- resources/DrugBank.txt, with random names of each entity type
+## -- mixed with filler words.
+## --
+
+FILLER = ["the", "of", "and", "patients", "with", "was", "increased", "decreased", "plasma",
+          "levels", "may", "inhibit", "the", "metabolism", "in", "mg", "10", "dose", "(", ")",
+          ",", "when", "administered", "concomitantly", "effect", "clearance", "is", "not"]
+SYLLABLES = ["ab", "cor", "da", "fen", "gli", "lo", "mi", "na", "pra", "ri", "sta", "te", "vo", "xa", "zi"]
+SUFFIXES = ["amine", "azole", "cillin", "dine", "floxacin", "mab", "ol", "sartan", "statin", "vir"]
+
+def synthetic_name(rng, kind) :
+    stem = "".join(rng.choice(SYLLABLES) for i in range(rng.randint(1, 3)))
+    if kind == "drug" : return stem + rng.choice(SUFFIXES)
+    if kind == "brand" : return stem.capitalize() + rng.choice(["ex", "in", "on", "a"])
+    if kind == "group" : return stem + rng.choice(SUFFIXES) + " " + rng.choice(["inhibitors", "agents", "blockers"])
+    return stem.upper()[:3] + "-" + str(rng.randint(10, 999))
+
+
+def synthetic_corpus(basedir, ndocs, nsent, seed=0) :
+    rng = random.Random(seed)
+    kinds = ["drug"]*6 + ["brand"]*2 + ["group"]*2 + ["drug_n"]
+    names = { k : sorted(set(synthetic_name(rng, k) for i in range(200))) for k in set(kinds) }
+
+    # DrugBank knows most names, but not all of them
+    os.makedirs(os.path.join(basedir, "resources"), exist_ok=True)
+    with open(os.path.join(basedir, "resources", "DrugBank.txt"), "w") as f :
+        for k in sorted(names) :
+            for name in names[k] :
+                if rng.random() < 0.8 : f.write(name + "|" + k + "\n")
+
+    for (split, n) in [("train", ndocs), ("devel", max(1, ndocs//4))] :
+        datadir = os.path.join(basedir, "data", split)
+        os.makedirs(datadir, exist_ok=True)
+        for d in range(n) :
+            did = "DDI-Bench."+split+"."+str(d)
+            lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<document id='+quoteattr(did)+'>']
+            for s in range(nsent) :
+                sid = did+".s"+str(s)
+                (words, entities, pos) = ([], [], 0)
+                for i in range(rng.randint(8, 30)) :
+                    if rng.random() < 0.15 :
+                        kind = rng.choice(kinds)
+                        word = rng.choice(names[kind])
+                        entities.append((pos, pos+len(word)-1, kind, word))
+                    else :
+                        word = rng.choice(FILLER)
+                    words.append(word)
+                    pos += len(word)+1
+                lines.append('<sentence id='+quoteattr(sid)+' text='+quoteattr(" ".join(words)+" .")+'>')
+                for (e, (start, end, kind, word)) in enumerate(entities) :
+                    lines.append('<entity id='+quoteattr(sid+".e"+str(e))+' charOffset="'+str(start)+'-'+str(end)+
+                                 '" type="'+kind+'" text='+quoteattr(word)+'/>')
+                lines.append('</sentence>')
+            lines.append('</document>')
+            with open(os.path.join(datadir, "d"+str(d)+".xml"), "w", encoding="utf-8") as f :
+                f.write("\n".join(lines)+"\n")
+
+
+## --
+## -- Run func(*args) in a forked child.  func returns a dictionary with
+## -- the results of the stage, which gets the peak RSS of the child.
+## --
+
+def measure(func, *args) :
+    (r, w) = os.pipe()
+    pid = os.fork()
+    if pid == 0 :
+        os.close(r)
+        status = 0
+        try :
+            with os.fdopen(w, "w") as f :
+                json.dump(func(*args), f)
+        except BaseException :
+            traceback.print_exc()
+            status = 1
+        os._exit(status)
+
+    os.close(w)
+    with os.fdopen(r) as f :
+        data = f.read()
+    (_, status, usage) = os.wait4(pid, 0)
+    if status != 0 :
+        raise RuntimeError("stage "+func.__name__+" failed")
+    result = json.loads(data)
+    result["peak_rss_mb"] = usage.ru_maxrss/1024
+    return result
+
+
+## --
+## -- Run a pipeline script with given arguments and stdin/stdout files,
+## -- and return its wall time and peak RSS
+## --
+
+def measure_script(cmd, stdin=None, stdout=None) :
+    fin = open(stdin, "rb") if stdin else None
+    fout = open(stdout, "wb") if stdout else subprocess.DEVNULL
+    try :
+        start = time.perf_counter()
+        p = subprocess.Popen([sys.executable, os.path.join(CODEDIR, cmd[0])] + cmd[1:], stdin=fin, stdout=fout)
+        (_, status, usage) = os.wait4(p.pid, 0)
+        seconds = time.perf_counter() - start
+        p.returncode = status
+    finally :
+        if fin : fin.close()
+        if stdout : fout.close()
+    if status != 0 :
+        raise RuntimeError(cmd[0]+" failed")
+    return { "seconds" : seconds, "peak_rss_mb" : usage.ru_maxrss/1024 }
+
+
+## load a pipeline script (e.g. predict-sklearn.py) as a module
+def script(name) :
+    spec = importlib.util.spec_from_file_location(name[:-3].replace("-", "_"), os.path.join(CODEDIR, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+## best time of 'repeat' calls to func
+def best_time(func, repeat) :
+    best = None
+    for r in range(repeat) :
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best : best = elapsed
+    return best
+
+
+## --
+## -- Stages.  Each one returns "seconds" and, for rate stages, the
+## -- "count" of processed items and their "unit".
+## --
+
+def bench_lexicon(ctx) :
+    from Lexicon import Lexicon
+    seconds = best_time(lambda: Lexicon(ctx["drugbank"]), ctx["repeat"])
+    return { "seconds" : seconds }
+
+
+def bench_tokenize(ctx) :
+    from corpus import read_corpus
+    from tokenizer import TOKENIZERS
+    tokenize = TOKENIZERS[ctx["tokenizer"]]
+    texts = [stext for (sid, stext, entities, pairs) in read_corpus(ctx["train"])]
+    tokenize("warm up")  # do not count tokenizer imports
+    ntok = sum(len(tokenize(t)) for t in texts)
+    seconds = best_time(lambda: [tokenize(t) for t in texts], ctx["repeat"])
+    return { "seconds" : seconds, "count" : ntok, "unit" : "tokens" }
+
+
+## tokenization, features and tags, as extract-features.py does.
+## Feature files of train and devel are written for the next stages.
+def bench_features(ctx) :
+    import featfile
+    from features import set_lexicon
+    from Lexicon import Lexicon
+    extract = script("extract-features.py")
+    extract.init_worker(ctx["drugbank"], ctx["tokenizer"])
+    lexicon = Lexicon.load(ctx["drugbank"])
+    files = [os.path.join(ctx["train"], f) for f in sorted(os.listdir(ctx["train"]))]
+
+    def run() :
+        set_lexicon(lexicon)  # start with empty feature caches
+        return [s for f in files for s in extract.process_file(f)]
+    seconds = best_time(run, ctx["repeat"])
+
+    for (split, fmt) in [("train", "text"), ("train", "bin"), ("devel", "text")] :
+        datadir = ctx[split]
+        with open(ctx[split+"."+fmt], "wb") as f :
+            out = featfile.FORMATS[fmt](f)
+            for fn in sorted(os.listdir(datadir)) :
+                for sentence in extract.process_file(os.path.join(datadir, fn)) : out.add(*sentence)
+            out.close()
+
+    ntok = sum(len(s[0]) for s in run())
+    return { "seconds" : seconds, "count" : ntok, "unit" : "tokens" }
+
+
+def bench_train_crf(ctx) :
+    import CRF
+    import featfile
+    with open(ctx["train.text"], "rb") as f :
+        data = [(xseq, tags) for toks, tags, xseq in featfile.instances(f)]
+    start = time.perf_counter()
+    CRF.train(data, ctx["model.crf"])
+    return { "seconds" : time.perf_counter() - start }
+
+
+def bench_predict(ctx, modelfile, outfile, options={}) :
+    import featfile
+    from ML_model import ML_model, decode
+    from predict import chunks
+    with open(ctx["devel.text"], "rb") as f :
+        data = [(xseq, toks) for toks, tags, xseq in featfile.instances(f) if xseq]
+    model = ML_model(modelfile, **options)
+
+    def run() :
+        entities = []
+        for chunk in chunks(data, 200) :
+            predictions = model.predict_batch([xseq for xseq, toks in chunk])
+            entities.extend(e for (xseq, toks), y in zip(chunk, predictions) for e in decode(toks, y))
+        return entities
+    seconds = best_time(run, ctx["repeat"])
+
+    with open(outfile, "w") as f :
+        for e in run() : print(*e, sep="|", file=f)
+    return { "seconds" : seconds, "count" : len(data), "unit" : "sentences" }
+
+def bench_predict_crf(ctx) :
+    return bench_predict(ctx, ctx["model.crf"], ctx["devel-CRF.out"])
+
+def bench_predict_nb(ctx) :
+    return bench_predict(ctx, ctx["model.joblib"], ctx["devel-NB.out"], { "vectorizer" : ctx["vectorizer.joblib"] })
+
+
+def bench_evaluate(ctx) :
+    from evaluator import Evaluator
+    def run() :
+        return Evaluator("NER", ctx["devel"]).score_file(ctx["devel-CRF.out"])
+    seconds = best_time(run, ctx["repeat"])
+    return { "seconds" : seconds, "microF1" : run()["m.avg"]["F1"] }
+
+
+def run_benchmarks(ctx, models) :
+    results = {}
+    def stage(name, func) :
+        print("[run]", name, file=sys.stderr)
+        results[name] = measure(func, ctx)
+
+    stage("lexicon", bench_lexicon)
+    stage("tokenize", bench_tokenize)
+    stage("features", bench_features)
+    if "crf" in models :
+        stage("train-crf", bench_train_crf)
+        stage("predict-crf", bench_predict_crf)
+        stage("evaluate", bench_evaluate)
+    if "nb" in models :
+        print("[run]", "train-nb", file=sys.stderr)
+        results["train-nb"] = measure_script(["train-sklearn.py", ctx["model.joblib"], ctx["vectorizer.joblib"]],
+                                             stdin=ctx["train.bin"])
+        stage("predict-nb", bench_predict_nb)
+
+    for r in results.values() :
+        if "count" in r :
+            r["rate"] = r["count"]/r["seconds"] if r["seconds"] else 0
+    return results
+
+
+## --
+## -- Compare with results of a previous run.  Rates (or times, for
+## -- stages without a rate) and peak RSS worse by more than 'threshold'
+## -- (relative) are flagged as regressions.
+## --
+
+def compare(old, new, threshold) :
+    regressions = []
+    print(row("stage")+"{:>14}{:>14}{:>9}".format("old", "new", "change"))
+    print("----------------------------------------------------------------")
+    for name in new :
+        if name not in old : continue
+        (o, n) = (old[name], new[name])
+        checks = [("rate", 1), ("seconds", -1)] if "rate" in n else [("seconds", -1)]
+        for (metric, sign) in checks[:1] + [("peak_rss_mb", -1)] :
+            if metric not in o or not o[metric] : continue
+            change = n[metric]/o[metric] - 1
+            flag = sign*change < -threshold
+            if flag : regressions.append(name+" "+metric)
+            print(row(name+" "+metric)+"{:>14.4g}{:>14.4g}{:>+9.1%}{}".format(o[metric], n[metric], change,
+                                                                            "  REGRESSION" if flag else ""))
+    return regressions
+
+
+def row(txt) :
+   return txt + ' '*(24-len(txt))
+
+
+def print_results(results) :
+    print(row("stage")+"{:>12}{:>24}{:>16}".format("time (s)", "rate", "peak RSS (MB)"))
+    print("----------------------------------------------------------------------------")
+    for (name, r) in results.items() :
+        rate = "{:.0f} {}/s".format(r["rate"], r["unit"]) if "rate" in r else ""
+        print(row(name)+"{:>12.3f}{:>24}{:>16.1f}".format(r["seconds"], rate, r["peak_rss_mb"]))
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  benchmark.py [--basedir DIR | --docs N --sentences S] [--tokenizer T]
+## --                      [--models crf,nb] [--repeat R] [-o results.json]
+## --                      [--compare old.json] [--threshold 0.1]
+## --
+## -- Benchmarks all pipeline stages on the DDI corpus in DIR (data/train,
+## -- data/devel, resources/DrugBank.txt) or on a synthetic corpus of N
+## -- documents of S sentences.  Rate stages report the best of R runs.
+## -- Results are printed and saved as JSON.  With --compare, they are
+## -- checked against a previous JSON file, and the exit status is 1 if
+## -- some stage is slower (or uses more memory) beyond the threshold.
+## --
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--basedir", help="DDI directory, with data/ and resources/ (default: synthetic corpus)")
+    parser.add_argument("--docs", type=int, default=100, help="documents in the synthetic train split")
+    parser.add_argument("--sentences", type=int, default=20, help="sentences per synthetic document")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic corpus")
+    parser.add_argument("--tokenizer", default="nltk", help="tokenizer (nltk|regex)")
+    parser.add_argument("--models", default="crf,nb", help="comma separated models to benchmark (crf,nb)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each rate stage (best is kept)")
+    parser.add_argument("-o", "--output", help="JSON file where results are written")
+    parser.add_argument("--compare", help="JSON results of a previous run, to flag regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change flagged as a regression")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="ddibench") as workdir :
+        basedir = args.basedir
+        if basedir is None :
+            basedir = os.path.join(workdir, "corpus")
+            synthetic_corpus(basedir, args.docs, args.sentences, args.seed)
+
+        ctx = { "train" : os.path.join(basedir, "data", "train"),
+                "devel" : os.path.join(basedir, "data", "devel"),
+                "drugbank" : os.path.join(basedir, "resources", "DrugBank.txt"),
+                "tokenizer" : args.tokenizer,
+                "repeat" : args.repeat }
+        for f in ["train.text", "train.bin", "devel.text", "model.crf", "devel-CRF.out",
+                  "model.joblib", "vectorizer.joblib", "devel-NB.out"] :
+            ctx[f] = os.path.join(workdir, f)
+
+        results = run_benchmarks(ctx, args.models.split(","))
+
+    report = { "meta" : { "date" : time.strftime("%Y-%m-%d %H:%M:%S"),
+                          "python" : platform.python_version(),
+                          "platform" : platform.platform(),
+                          "corpus" : args.basedir or "synthetic:%d:%d:%d" % (args.docs, args.sentences, args.seed),
+                          "tokenizer" : args.tokenizer },
+               "stages" : results }
+
+    print_results(results)
+    if args.output :
+        with open(args.output, "w") as f :
+            json.dump(report, f, indent=2)
+
+    if args.compare :
+        with open(args.compare) as f :
+            old = json.load(f)
+        if old["meta"]["corpus"] != report["meta"]["corpus"] :
+            print("Warning: comparing runs on different corpora", file=sys.stderr)
+        print()
+        regressions = compare(old["stages"], results, args.threshold)
+        if regressions :
+            print("\nRegressions: " + ", ".join(regressions))
+            sys.exit(1)
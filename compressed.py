@@ -0,0 +1,147 @@
+#####################################################
+## Transparent compression of pipeline files
+#####################################################
+##
+## Feature files and system outputs may be compressed with gzip, zstd
+## or lz4.  Readers detect compressed streams by their magic bytes, so
+## any input (a file, or stdin in a pipe) may be compressed or not.
+## Writers compress with the codec given, or the one of the file
+## extension (.gz, .zst, .lz4).  Data are (de)compressed as they are
+## read or written, with no temporary files.
+##
+## gzip is in the standard library; zstd and lz4 need the zstandard
+## and lz4 packages, imported only when used.
+
+import io
+import sys
+
+## codec -> (magic bytes, file extension)
+CODECS = { "gzip" : (b"\x1f\x8b", ".gz"),
+           "zstd" : (b"\x28\xb5\x2f\xfd", ".zst"),
+           "lz4" : (b"\x04\x22\x4d\x18", ".lz4") }
+
+
+def codec_of(path) :
+    for codec, (magic, extension) in CODECS.items() :
+        if path.endswith(extension) : return codec
+    return None
+
+def require(codec) :
+    try :
+        if codec == "zstd" :
+            import zstandard
+            return zstandard
+        elif codec == "lz4" :
+            import lz4.frame
+            return lz4.frame
+        import gzip
+        return gzip
+    except ImportError as e :
+        raise ImportError("Reading or writing " + codec + " files needs the " +
+                          { "zstd" : "zstandard", "lz4" : "lz4" }[codec] + " package") from e
+
+
+## --
+## -- Binary stream f with the first bytes given back, for pipes where
+## -- peeking returned too few bytes to check the magic
+## --
+
+class Rewound(io.RawIOBase) :
+
+    def __init__(self, head, f) :
+        self.head = head
+        self.f = f
+
+    def readable(self) :
+        return True
+
+    def readinto(self, b) :
+        if self.head :
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        return self.f.readinto(b)
+
+
+## --
+## -- Decompressing reader for binary stream f, if it starts with the
+## -- magic of some codec, or f itself (buffered) otherwise
+## --
+
+def reader(f) :
+    if not hasattr(f, "peek") :
+        f = io.BufferedReader(f)
+    head = f.peek(4)[:4]
+    if 0 < len(head) < 4 :
+        head = f.read(4)
+        f = io.BufferedReader(Rewound(head, f), 1 << 16)
+
+    for codec, (magic, extension) in CODECS.items() :
+        if head.startswith(magic) :
+            module = require(codec)
+            if codec == "zstd" :
+                return io.BufferedReader(module.ZstdDecompressor().stream_reader(f, read_across_frames=True), 1 << 16)
+            elif codec == "lz4" :
+                return module.LZ4FrameFile(f, "rb")
+            return module.GzipFile(fileobj=f, mode="rb")
+    return f
+
+## binary stream with the (decompressed) contents of file path ("-" for stdin)
+def open_input(path="-") :
+    return reader(sys.stdin.buffer if path == "-" else open(path, "rb"))
+
+
+## --
+## -- Compressing writer: compresses data written to it into file f,
+## -- and on close, ends the compressed stream and closes f
+## --
+
+class Output(io.BufferedIOBase) :
+
+    def __init__(self, f, codec) :
+        self.f = f
+        module = require(codec)
+        if codec == "zstd" :
+            self.stream = module.ZstdCompressor(level=3).stream_writer(f, closefd=False)
+        elif codec == "lz4" :
+            self.stream = module.LZ4FrameFile(f, "wb")
+        else :
+            self.stream = module.GzipFile(fileobj=f, mode="wb", compresslevel=6)
+
+    def writable(self) :
+        return True
+
+    def write(self, b) :
+        self.stream.write(b)
+        return len(b)
+
+    def flush(self) :
+        # compressors end a block on flush: just flush f
+        self.f.flush()
+
+    def close(self) :
+        if not self.closed :
+            super().close()
+            self.stream.close()
+            self.f.close()
+
+
+## --
+## -- Binary stream writing to file path ("-" for stdout), compressed
+## -- with given codec, by default the one of the path extension (if
+## -- any).  Closing it does not close stdout.
+## --
+
+def open_output(path="-", codec=None) :
+    if codec is None : codec = codec_of(path)
+    if path == "-" :
+        sys.stdout.flush()
+        f = open(sys.stdout.fileno(), "wb", closefd=False)
+    else :
+        f = open(path, "wb")
+    return Output(f, codec) if codec else f
+
+## text stream for open_output
+def open_text_output(path="-", codec=None) :
+    return io.TextIOWrapper(open_output(path, codec), encoding="utf-8")
@@ -0,0 +1,39 @@
+#####################################################
+## Streaming reader for DDI XML corpora
+#####################################################
+
+from os import listdir
+from xml.etree.ElementTree import iterparse
+
+## --
+## -- Yield one record (sid, text, entities, pairs) for each sentence
+## -- in given XML file.  entities and pairs are lists with the
+## -- attribute dictionaries of the <entity> and <pair> elements.
+## -- Each sentence element is discarded once yielded, so memory
+## -- does not grow with the size of the file.
+## --
+
+def read_sentences(filename) :
+    root = None
+    for event, elem in iterparse(filename, events=("start", "end")) :
+        if root is None :
+            root = elem
+        if event != "end" or elem.tag != "sentence" :
+            continue
+
+        entities = [dict(e.attrib) for e in elem.iter("entity")]
+        pairs = [dict(p.attrib) for p in elem.iter("pair")]
+        yield (elem.attrib["id"], elem.attrib["text"], entities, pairs)
+
+        # free the sentence, and the already processed part of the tree
+        elem.clear()
+        root.clear()
+
+
+## --
+## -- Yield sentence records for all XML files in given directory
+## --
+
+def read_corpus(datadir) :
+    for f in listdir(datadir) :
+        yield from read_sentences(datadir+"/"+f)
@@ -0,0 +1,217 @@
+#! /usr/bin/python3
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from statistics import mean, stdev
+from multiprocessing import Pool
+
+import featfile
+import features
+import CRF
+from ML_model import decode
+from evaluator import load_gold, predicted_set, get_statistics
+
+## --
+## -- K-fold cross-validation of the CRF tagger on a DDI corpus.
+## --
+## -- Features are extracted once for the whole corpus (with
+## -- extract-features.py, or read from a given feature file), and
+## -- sentences are grouped in documents (sentence id without its
+## -- last ".sN" part).  Documents are shuffled and dealt into k
+## -- folds.  Each fold is tagged by a model trained on the other
+## -- k-1, in a pool of worker processes sharing the extracted
+## -- sentences, and scored against the gold instances of its own
+## -- sentences.
+## --
+
+CODEDIR = os.path.dirname(os.path.abspath(__file__))
+
+
+## document id of a sentence id, e.g. DDI-DrugBank.d12.s3 -> DDI-DrugBank.d12
+def document(sid) :
+    return sid.rsplit(".", 1)[0]
+
+## --
+## -- Fold number of each document: documents are sorted, shuffled
+## -- with given seed, and dealt in turn to each of k folds.
+## --
+
+def assign_folds(docs, k, seed=0) :
+    docs = sorted(docs)
+    random.Random(seed).shuffle(docs)
+    return { d : i % k for i, d in enumerate(docs) }
+
+## gold instances (see evaluator.load_gold) of given sentences only
+def restrict_gold(gold, sids) :
+    return { kind : set(e for e in gold[kind] if e.split("|")[0] in sids) for kind in gold }
+
+
+## --
+## -- Extraction: features for all sentences in datadir, as a list of
+## -- (toks, tags, xseq).  extract-features.py writes them in binary
+## -- format to a temporary file.
+## --
+
+def extract(datadir, options) :
+    with tempfile.TemporaryFile() as f :
+        subprocess.run([sys.executable, os.path.join(CODEDIR, "extract-features.py"), "--format", "bin"]
+                       + options + [datadir], stdout=f, check=True)
+        f.seek(0)
+        return list(featfile.instances(f))
+
+
+# sentences, fold of each sentence, gold set and training settings,
+# shared by all folds in a worker process
+sentences = None
+folds = None
+gold = None
+settings = None
+
+def init_worker(sents, fold, gld, sets) :
+    global sentences, folds, gold, settings
+    (sentences, folds, gold, settings) = (sents, fold, gld, sets)
+
+## --
+## -- Train on all folds but k, tag fold k, and score it.
+## --
+
+def run_fold(k) :
+    (algorithm, params, tmpdir) = settings
+    modelfile = os.path.join(tmpdir, "fold%d.crf" % k)
+    train = ((xseq, tags) for (toks, tags, xseq), f in zip(sentences, folds) if f != k)
+    CRF.train(train, modelfile, algorithm, params)
+
+    tagger = CRF.CRF(modelfile)
+    test = [(toks, xseq) for (toks, tags, xseq), f in zip(sentences, folds) if f == k]
+    predicted = [e for toks, xseq in test for e in decode(toks, tagger.predict(xseq))]
+    sids = set(toks[0][0] for toks, xseq in test)
+    os.remove(modelfile)
+    return k, len(test), get_statistics(restrict_gold(gold, sids), predicted_set(predicted))
+
+
+## --
+## -- Mean and standard deviation over folds of P, R and F1 for each
+## -- kind and for the averages, as { row : { "P" : (mean,std), ... } }
+## --
+
+ROWS = ["M.avg", "m.avg", "m.avg(no class)"]
+
+def summarize(results) :
+    def spread(values) :
+        return (mean(values), stdev(values) if len(values) > 1 else 0.0)
+
+    kinds = sorted(set(kind for r in results for kind in r["kinds"]))
+    summary = {}
+    for kind in kinds :
+        summary[kind] = { m : spread([r["kinds"][kind][m] if kind in r["kinds"] else 0 for r in results])
+                          for m in ["P", "R", "F1"] }
+    for name in ROWS :
+        summary[name] = { m : spread([r[name][m] for r in results]) for m in ["P", "R", "F1"] }
+    return summary
+
+
+def print_summary(summary, results) :
+    cell = "{:5.1%} ± {:4.1%}"
+    print(" "*17 + "\t".join("{:^14}".format(m) for m in ["P", "R", "F1"]))
+    print("------------------------------------------------------------------------------")
+    for name in sorted(summary) :
+        if name in ROWS : continue
+        print(name.ljust(17) + "\t".join(cell.format(*summary[name][m]) for m in ["P", "R", "F1"]))
+    print("------------------------------------------------------------------------------")
+    for name in ROWS :
+        print(name.ljust(17) + "\t".join(cell.format(*summary[name][m]) for m in ["P", "R", "F1"]))
+    print()
+    print("fold\tm.avg F1\tM.avg F1")
+    for k, r in enumerate(results) :
+        print("{}\t{:2.1%}\t\t{:2.1%}".format(k, r["m.avg"]["F1"], r["M.avg"]["F1"]))
+
+
+## --
+## -- Usage:  crossval.py [--folds K] [--seed S] [--workers W] [--features FILE]
+## --                     [--tokenizer T] [--all-groups] [--cache DB]
+## --                     [--algorithm A] [--c1 C1] [--c2 C2] [--minfreq F]
+## --                     [--groups G,...] [--exclude-groups G,...] [--json FILE] datadir
+## --
+## -- Cross-validates the CRF on the XML files in datadir, with K folds
+## -- of documents (default 5), trained in W processes, and prints the
+## -- mean and standard deviation over folds of P, R and F1 for each
+## -- entity type and for the macro and micro averages.
+## -- Features are extracted with extract-features.py (--tokenizer,
+## -- --all-groups and --cache are passed to it) unless --features
+## -- gives an already extracted file for datadir.  Training options
+## -- are those of train-crf.py.  --json also writes per-fold statistics
+## -- and the summary to FILE.
+## --
+
+if __name__ == "__main__" :
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("datadir", help="directory with the XML files of the corpus")
+    parser.add_argument("--folds", type=int, default=5, help="number of folds")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the assignment of documents to folds")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--features", help="feature file already extracted from datadir")
+    parser.add_argument("--tokenizer", default="nltk", help="tokenizer for the extraction")
+    parser.add_argument("--all-groups", action="store_true", help="extract all feature groups")
+    parser.add_argument("--cache", help="feature cache for the extraction (see extract-features.py)")
+    parser.add_argument("--algorithm", default="l2sgd", choices=["l2sgd", "lbfgs"], help="training algorithm")
+    parser.add_argument("--c1", type=float, help="coefficient for L1 regularization (lbfgs only)")
+    parser.add_argument("--c2", type=float, default=0.1, help="coefficient for L2 regularization")
+    parser.add_argument("--minfreq", type=float, default=1, help="minimum frequency of a feature to consider it")
+    parser.add_argument("--groups", help="comma separated feature groups to use (default: all extracted)")
+    parser.add_argument("--exclude-groups", help="comma separated feature groups to leave out")
+    parser.add_argument("--json", help="write per-fold statistics and summary to this file")
+    args = parser.parse_args()
+    if args.folds < 2 :
+        parser.error("--folds must be at least 2")
+    if args.c1 is not None and args.algorithm != "lbfgs" :
+        parser.error("--c1 needs --algorithm lbfgs")
+    try :
+        select = features.group_filter(args.groups, args.exclude_groups)
+    except ValueError as e :
+        parser.error(str(e))
+
+    # features for the whole corpus, once
+    if args.features :
+        with open(args.features, "rb") as f :
+            sents = list(featfile.instances(f))
+    else :
+        options = ["--tokenizer", args.tokenizer, "--workers", str(args.workers)]
+        if args.all_groups : options.append("--all-groups")
+        if args.cache : options += ["--cache", args.cache]
+        sents = extract(args.datadir, options)
+    # sentences without tokens have nothing to train or tag
+    sents = [(toks, tags, select(xseq) if select else xseq) for toks, tags, xseq in sents if toks]
+
+    sids = [toks[0][0] for toks, tags, xseq in sents]
+    docs = assign_folds(set(document(sid) for sid in sids), args.folds, args.seed)
+    if len(docs) < args.folds :
+        sys.exit("Only {} documents, cannot make {} folds".format(len(docs), args.folds))
+    fold = [docs[document(sid)] for sid in sids]
+    gld = load_gold("NER", args.datadir)
+
+    params = { "feature.minfreq" : args.minfreq, "c2" : args.c2 }
+    if args.c1 is not None : params["c1"] = args.c1
+
+    tmpdir = tempfile.mkdtemp(prefix="crossval")
+    try :
+        results = [None] * args.folds
+        workers = min(args.workers, args.folds)
+        with Pool(workers, initializer=init_worker, initargs=(sents, fold, gld, (args.algorithm, params, tmpdir))) as pool :
+            for k, n, stats in pool.imap_unordered(run_fold, range(args.folds)) :
+                print("fold {}: {} sentences, m.avg F1 {:2.1%}".format(k, n, stats["m.avg"]["F1"]), file=sys.stderr)
+                results[k] = stats
+    finally :
+        shutil.rmtree(tmpdir)
+
+    summary = summarize(results)
+    print_summary(summary, results)
+    if args.json :
+        with open(args.json, "w") as f :
+            json.dump({ "folds" : results, "summary" : summary }, f, indent=1)
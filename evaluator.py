@@ -1,9 +1,15 @@
 #! /usr/bin/python3
 
+import io
+import os
 import sys
+import pickle
+import hashlib
+import tempfile
 from os import listdir
 
-from xml.dom.minidom import parse
+from corpus import read_corpus
+from compressed import open_input
 
 ## --
 ## -- auxliary to insert an instance in given instance_set
@@ -23,23 +29,14 @@ def add_instance(instance_set, einfo, etype) :
 def load_gold_NER(golddir) :
     entities = { "CLASS" : set([]), "NOCLASS" : set([]) }
 
-    # process each file in directory
-    for f in listdir(golddir) :
+    # process each sentence in each file in directory
+    for (sid, stext, ents, pairs) in read_corpus(golddir) :
 
-        # parse XML file, obtaining a DOM tree
-        tree = parse(golddir+"/"+f)
-
-        # process each sentence in the file
-        sentences = tree.getElementsByTagName("sentence")
-        for s in sentences :
-            sid = s.attributes["id"].value   # get sentence id
-            
-            # load sentence entities
-            ents = s.getElementsByTagName("entity")
-            for e in ents :
-                einfo = sid + "|" + e.attributes["charOffset"].value  + "|" + e.attributes["text"].value
-                etype = e.attributes["type"].value
-                add_instance(entities, einfo, etype)
+        # load sentence entities
+        for e in ents :
+            einfo = sid + "|" + e["charOffset"]  + "|" + e["text"]
+            etype = e["type"]
+            add_instance(entities, einfo, etype)
             
     return entities
 
@@ -50,40 +47,91 @@ def load_gold_NER(golddir) :
 def load_gold_DDI(golddir) :
     relations = { "CLASS" : set([]), "NOCLASS" : set([]) }
 
-    # process each file in directory
-    for f in listdir(golddir) :
-
-        # parse XML file, obtaining a DOM tree
-        tree = parse(golddir+"/"+f)
-
-        # process each sentence in the file
-        sentences = tree.getElementsByTagName("sentence")
-        for s in sentences :
-            sid = s.attributes["id"].value   # get sentence id
+    # process each sentence in each file in directory
+    for (sid, stext, ents, pairs) in read_corpus(golddir) :
         
-            # load "pairs"  in the sentence, keep those with ddi=true
-            pairs = s.getElementsByTagName("pair")
-            for p in pairs:
-                id_e1 = p.attributes["e1"].value
-                id_e2 = p.attributes["e2"].value
-                ddi = p.attributes["ddi"].value
-
-                if (ddi == "true") :
-                    rtype = p.attributes["type"].value
-                    rinfo = sid + "|" + id_e1 + "|" +  id_e2
-                    add_instance(relations, rinfo, rtype)
+        # load "pairs"  in the sentence, keep those with ddi=true
+        for p in pairs:
+            id_e1 = p["e1"]
+            id_e2 = p["e2"]
+            ddi = p["ddi"]
+
+            if (ddi == "true") :
+                rtype = p["type"]
+                rinfo = sid + "|" + id_e1 + "|" +  id_e2
+                add_instance(relations, rinfo, rtype)
 
     return relations
 
 
 ## --
-## -- Load entities/relations from given system output file
+## -- Load gold entities/relations for given task from golddir.
+## -- If cachedir is given, the loaded set is kept there, in a file
+## -- named after the hash of the contents of golddir, and reused
+## -- while golddir does not change.
+## --
+
+def load_gold(task, golddir, cachedir=None) :
+    if task=="NER" :
+        loader = load_gold_NER
+    elif task == "DDI" :
+        loader = load_gold_DDI
+    else :
+        raise ValueError("Invalid task '"+task+"'. Please specify 'NER' or 'DDI'.")
+
+    if cachedir is None :
+        return loader(golddir)
+
+    h = hashlib.sha1(task.encode())
+    for f in sorted(listdir(golddir)) :
+        with open(os.path.join(golddir, f), "rb") as fi :
+            h.update(f.encode() + b"\0" + fi.read() + b"\0")
+    cachefile = os.path.join(cachedir, task + "-" + h.hexdigest() + ".gold")
+
+    try :
+        with open(cachefile, "rb") as f :
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) :
+        pass
+
+    gold = loader(golddir)
+
+    # write to a temporary file and rename, as Lexicon.load does.  If
+    # cachedir is not writable, just go on without cache.
+    try :
+        os.makedirs(cachedir, exist_ok=True)
+        (fd, tmpfile) = tempfile.mkstemp(dir=cachedir)
+        try :
+            with os.fdopen(fd, "wb") as f :
+                pickle.dump(gold, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpfile, cachefile)
+        except BaseException :
+            # interrupted or failed: leave no temporary file behind
+            os.unlink(tmpfile)
+            raise
+    except OSError :
+        pass
+    return gold
+
+
+## --
+## -- Load entities/relations from given system output file (possibly
+## -- compressed, see compressed.py)
 ## --
 
 def load_predicted(task, outfile) :
+    with io.TextIOWrapper(open_input(outfile)) as outf :
+        return predicted_set(outf)
+
+## --
+## -- Load entities/relations from an iterable of system output lines
+## -- ("sid|...|type" strings, or tuples with the same fields)
+## --
+
+def predicted_set(lines) :
     predicted = { "CLASS" : set([]), "NOCLASS" : set([]) }
-    outf = open(outfile,"r")
-    for line in outf.readlines() :
+    for line in lines :
+        if isinstance(line, tuple) : line = "|".join(line)
         line = line.strip()
         if line in predicted["CLASS"] :
             print("Ignoring duplicated entity in system predictions file: "+line)
@@ -92,7 +140,6 @@ def load_predicted(task, outfile) :
         etype = line.split("|")[-1]
         einfo = "|".join(line.split("|")[:-1])
         add_instance(predicted, einfo, etype)
-        outf.close()
         
     return predicted
     
@@ -134,66 +181,248 @@ def row(txt) :
    return txt + ' '*(17-len(txt))
 
 
-def print_statistics(gold,predicted) :
-    print(row("")+"  tp\t  fp\t  fn\t#pred\t#exp\tP\tR\tF1")
-    print("------------------------------------------------------------------------------")
+## --
+## -- Compute all statistics comparing predicted with gold.  Returns a
+## -- dictionary with the statistics for each kind, the macro average
+## -- ("M.avg") and the micro averages with and without class
+## -- ("m.avg", "m.avg(no class)")
+## --
+
+FIELDS = ["tp", "fp", "fn", "npred", "nexp", "P", "R", "F1"]
+
+def get_statistics(gold,predicted) :
+    results = { "kinds" : {} }
     (nk,sP,sR,sF1) = (0,0,0,0)
     for kind in sorted(gold) :
         if kind=="CLASS" or kind=="NOCLASS" : continue
-        (tp,fp,fn,npred,nexp,P,R,F1) = statistics(gold, predicted, kind)
-        print(row(kind)+"{:>4}\t{:>4}\t{:>4}\t{:>4}\t{:>4}\t{:2.1%}\t{:2.1%}\t{:2.1%}".format(tp,fp,fn,npred,nexp, P, R, F1))
-        (nk,sP,sR,sF1) = (nk+1, sP+P, sR+R, sF1+F1)
+        stats = dict(zip(FIELDS, statistics(gold, predicted, kind)))
+        results["kinds"][kind] = stats
+        (nk,sP,sR,sF1) = (nk+1, sP+stats["P"], sR+stats["R"], sF1+stats["F1"])
+
+    results["M.avg"] = { "P" : sP/nk, "R" : sR/nk, "F1" : sF1/nk } if nk else { "P" : 0, "R" : 0, "F1" : 0 }
+    results["m.avg"] = dict(zip(FIELDS, statistics(gold, predicted, "CLASS")))
+    results["m.avg(no class)"] = dict(zip(FIELDS, statistics(gold, predicted, "NOCLASS")))
+    return results
 
-    (sP, sR, sF1) = (sP/nk, sR/nk, sF1/nk)
+
+def print_results(results) :
+    line = "{tp:>4}\t{fp:>4}\t{fn:>4}\t{npred:>4}\t{nexp:>4}\t{P:2.1%}\t{R:2.1%}\t{F1:2.1%}"
+    print(row("")+"  tp\t  fp\t  fn\t#pred\t#exp\tP\tR\tF1")
     print("------------------------------------------------------------------------------")
-    print(row("M.avg")+"-\t-\t-\t-\t-\t{:2.1%}\t{:2.1%}\t{:2.1%}".format(sP, sR, sF1))
+    for kind in sorted(results["kinds"]) :
+        print(row(kind)+line.format(**results["kinds"][kind]))
 
     print("------------------------------------------------------------------------------")
-    (tp,fp,fn,npred,nexp,P,R,F1) = statistics(gold, predicted, "CLASS")
-    print(row("m.avg")+"{:>4}\t{:>4}\t{:>4}\t{:>4}\t{:>4}\t{:2.1%}\t{:2.1%}\t{:2.1%}".format(tp,fp,fn,npred,nexp, P, R, F1))                        
-    (tp,fp,fn,npred,nexp,P,R,F1) = statistics(gold, predicted, "NOCLASS")
-    print(row("m.avg(no class)")+"{:>4}\t{:>4}\t{:>4}\t{:>4}\t{:>4}\t{:2.1%}\t{:2.1%}\t{:2.1%}".format(tp,fp,fn,npred,nexp, P, R, F1))               
+    print(row("M.avg")+"-\t-\t-\t-\t-\t{P:2.1%}\t{R:2.1%}\t{F1:2.1%}".format(**results["M.avg"]))
+
+    print("------------------------------------------------------------------------------")
+    print(row("m.avg")+line.format(**results["m.avg"]))
+    print(row("m.avg(no class)")+line.format(**results["m.avg(no class)"]))
+
+
+def print_statistics(gold,predicted) :
+    print_results(get_statistics(gold, predicted))
+
+
+## --
+## -- Reusable evaluator: loads the gold set once (optionally through
+## -- a disk cache, see load_gold) and scores any number of prediction
+## -- sets against it, returning the statistics from get_statistics.
+## --
+
+class Evaluator :
+
+    def __init__(self, task, golddir, cachedir=None) :
+        self.task = task
+        self.gold = load_gold(task, golddir, cachedir)
+
+    ## score an iterable of predicted lines or tuples
+    def score(self, predictions) :
+        return get_statistics(self.gold, predicted_set(predictions))
+
+    def score_file(self, outfile) :
+        return get_statistics(self.gold, load_predicted(self.task, outfile))
+
+    ## score several output files, returning a dictionary outfile -> statistics
+    def score_files(self, outfiles) :
+        return { f : self.score_file(f) for f in outfiles }
+
+
+## --
+## -- Significance of the difference between two systems.
+## --
+## -- Predictions are compared with gold sentence by sentence, giving
+## -- an array of (tp,fp,fn) counts per sentence, for each kind and for
+## -- CLASS (micro average).  Resamples are then just weighted sums of
+## -- those rows, computed with NumPy in blocks:
+## --   - paired bootstrap: sentences drawn with replacement (the same
+## --     draw for both systems) give confidence intervals for micro and
+## --     macro F1 and for their difference, and a p-value for the
+## --     difference (shifted to the null hypothesis).
+## --   - approximate randomization: the outputs of both systems for
+## --     each sentence are swapped at random, and the p-value is the
+## --     share of trials with a difference at least as large as observed.
+## -- Sentences are those with some gold or predicted instance (the rest
+## -- add zero counts to every resample).
+## --
+
+def sentence_counts(gold, predicted, sids, kinds) :
+    import numpy as np
+    index = { sid : i for i, sid in enumerate(sids) }
+    counts = np.zeros((len(sids), len(kinds), 3))
+    for k, kind in enumerate(kinds) :
+        pred = predicted.get(kind, set([]))
+        for p in pred :
+            counts[index[p.split("|")[0]], k, 0 if p in gold[kind] else 1] += 1
+        for g in gold[kind] :
+            if g not in pred : counts[index[g.split("|")[0]], k, 2] += 1
+    return counts
+
+## F1 for (tp,fp,fn) counts in the last axis: 2tp/(2tp+fp+fn), or 0 if tp=0
+def f1_scores(counts) :
+    import numpy as np
+    (tp, fp, fn) = (counts[...,0], counts[...,1], counts[...,2])
+    return np.where(tp > 0, 2*tp / np.maximum(2*tp+fp+fn, 1), 0)
+
+## micro and macro F1 for summed counts of shape (..., kinds+CLASS, 3)
+def micro_macro(counts) :
+    f1 = f1_scores(counts)
+    return { "m.avg F1" : f1[...,-1],
+             "M.avg F1" : f1[...,:-1].mean(axis=-1) if f1.shape[-1] > 1 else 0*f1[...,-1] }
+
+
+def significance(gold, predictedA, predictedB, samples=10000, seed=0, block=500) :
+    import numpy as np
+    kinds = [k for k in sorted(gold) if k!="CLASS" and k!="NOCLASS"] + ["CLASS"]
+    sids = sorted(set(e.split("|")[0] for s in (gold, predictedA, predictedB) for e in s["CLASS"]))
+    A = sentence_counts(gold, predictedA, sids, kinds).reshape(len(sids), -1)
+    B = sentence_counts(gold, predictedB, sids, kinds).reshape(len(sids), -1)
+    shape = (len(kinds), 3)
+    (n, rng) = (len(sids), np.random.default_rng(seed))
+
+    (AB, totalA, totalB) = (np.hstack([A, B]), A.sum(axis=0), B.sum(axis=0))
+    scoreA = micro_macro(totalA.reshape(shape))
+    scoreB = micro_macro(totalB.reshape(shape))
+    delta = { m : scoreA[m] - scoreB[m] for m in scoreA }
+
+    boot = { m : ([], [], []) for m in scoreA }
+    ar = { m : 0 for m in scoreA }
+    for start in range(0, samples, block) :
+        size = min(block, samples-start)
+
+        # bootstrap: times each sentence is drawn, in each resample
+        draws = rng.integers(0, n, size=(size, n), dtype=np.int32) + (n*np.arange(size, dtype=np.int32))[:,None]
+        w = np.bincount(draws.ravel(), minlength=size*n).reshape(size, n).astype(float)
+        sums = w @ AB
+        bA = micro_macro(sums[:,:A.shape[1]].reshape((size,)+shape))
+        bB = micro_macro(sums[:,A.shape[1]:].reshape((size,)+shape))
+
+        # randomization: sentences whose outputs are swapped, in each trial
+        bits = rng.integers(0, 256, size=(size, (n+7)//8), dtype=np.uint8)
+        moved = np.unpackbits(bits, axis=1, count=n).astype(float) @ (B-A)
+        rA = micro_macro((totalA + moved).reshape((size,)+shape))
+        rB = micro_macro((totalB - moved).reshape((size,)+shape))
+
+        for m in scoreA :
+            boot[m][0].append(bA[m])
+            boot[m][1].append(bB[m])
+            boot[m][2].append(bA[m] - bB[m])
+            ar[m] += np.sum(np.abs(rA[m] - rB[m]) >= np.abs(delta[m]) - 1e-12)
+
+    results = {}
+    for m in scoreA :
+        (bA, bB, bD) = (np.concatenate(x) for x in boot[m])
+        ci = lambda x: tuple(np.percentile(x, [2.5, 97.5]))
+        results[m] = { "A" : float(scoreA[m]), "B" : float(scoreB[m]), "diff" : float(delta[m]),
+                       "A.ci" : ci(bA), "B.ci" : ci(bB), "diff.ci" : ci(bD),
+                       "p.bootstrap" : (np.sum(np.abs(bD - delta[m]) >= np.abs(delta[m]) - 1e-12) + 1) / (samples + 1),
+                       "p.randomization" : (ar[m] + 1) / (samples + 1) }
+    return results
+
+
+def print_significance(results, nameA, nameB, samples) :
+    print("A: "+nameA)
+    print("B: "+nameB)
+    print("Significance of A-B, "+str(samples)+" samples (95% bootstrap CI, p-values by bootstrap and approximate randomization)")
+    print(row("")+"A\t95% CI\t\tB\t95% CI\t\tA-B\t95% CI\t\tp.boot\tp.rand")
+    print("------------------------------------------------------------------------------------------------------------------------")
+    for m in results :
+        r = results[m]
+        ci = lambda c: "[{:2.1%},{:2.1%}]".format(*c)
+        print(row(m)+"{:2.1%}\t{}\t{:2.1%}\t{}\t{:+2.1%}\t{}\t{:.4f}\t{:.4f}".format(
+            r["A"], ci(r["A.ci"]), r["B"], ci(r["B.ci"]), r["diff"], ci(r["diff.ci"]),
+            r["p.bootstrap"], r["p.randomization"]))
+
 
 ## --
 ## -- Evaluates results in outfile comparing them with gold standard in golddir.
 ## -- 'task' is either NER or DDI
 ## -- This function can be called from any program requesting evaluation.
+## -- cachedir, if given, keeps the loaded gold set (see load_gold).
 ## --
  
-def evaluate(task, golddir, outfile):
-
-    if task=="NER" :
-        # get set of expected entities in the whole golddir
-        gold = load_gold_NER(golddir)
-    elif task == "DDI" :
-        # get set of expected relations in the whole golddir
-        gold = load_gold_DDI(golddir)
-    else :
-        print ("Invalid task '"+task+"'. Please specify 'NER' or 'DDI'.")        
+def evaluate(task, golddir, outfile, cachedir=None):
 
+    # get set of expected entities/relations in the whole golddir
+    try :
+        evaluator = Evaluator(task, golddir, cachedir)
+    except ValueError as e :
+        print(e)
+        return
 
-    # Load entities/relations predicted by the system
-    predicted = load_predicted(task, outfile)
-
-    # compare both sets and compute statistics
-    print_statistics(gold,predicted)
+    # compare predicted entities/relations with the gold set, and print statistics
+    print_results(evaluator.score_file(outfile))
          
         
 ## --
-## -- Usage as standalone program:  evaluator.py (NER|DDI) golddir outfile
+## -- Usage as standalone program:  evaluator.py [--gold-cache DIR] (NER|DDI) golddir outfile [outfile ...]
+## --                               evaluator.py --significance [--samples N] [--gold-cache DIR]
+## --                                            (NER|DDI) golddir outA outB
 ## --
-## -- Evaluates results in outfile comparing them with gold standard in golddir
+## -- Evaluates results in each outfile comparing them with gold standard in golddir.
+## -- --gold-cache DIR keeps the gold set loaded from golddir in DIR, to
+## -- skip parsing the XML files in later runs (see load_gold).
+## -- With --significance, tests whether the difference between the
+## -- results of the two given systems is significant (see significance()).
 ## --
 
 
 if __name__ == "__main__":
 
-    if len(sys.argv) != 4 :
-        print("\n  Usage: evaluator.py (NER|DDI) golddir outfile\n")
+    args = sys.argv[1:]
+    (test, samples, cachedir) = (False, 10000, None)
+    while args and args[0].startswith("--") :
+        if args[0] == "--significance" :
+            (test, args) = (True, args[1:])
+        elif args[0] == "--samples" and len(args) > 1 :
+            (samples, args) = (int(args[1]), args[2:])
+        elif args[0] == "--gold-cache" and len(args) > 1 :
+            (cachedir, args) = (args[1], args[2:])
+        else :
+            args = []
+
+    if len(args) < 3 or (test and len(args) != 4) :
+        print("\n  Usage: evaluator.py [--gold-cache DIR] (NER|DDI) golddir outfile [outfile ...]")
+        print("         evaluator.py --significance [--samples N] [--gold-cache DIR] (NER|DDI) golddir outA outB\n")
         exit()
         
-    task = sys.argv[1]
-    golddir = sys.argv[2]
-    outfile = sys.argv[3]
+    task = args[0]
+    golddir = args[1]
+    outfiles = args[2:]
+    if task not in ["NER", "DDI"] :
+        print("Invalid task '"+task+"'. Please specify 'NER' or 'DDI'.")
+        exit()
 
-    evaluate(task, golddir, outfile)
+    if test :
+        evaluator = Evaluator(task, golddir, cachedir)
+        (A, B) = (load_predicted(task, f) for f in outfiles)
+        print_significance(significance(evaluator.gold, A, B, samples), outfiles[0], outfiles[1], samples)
+    elif len(outfiles) == 1 :
+        evaluate(task, golddir, outfiles[0], cachedir)
+    else :
+        # load gold once, and score all files against it
+        evaluator = Evaluator(task, golddir, cachedir)
+        for outfile in outfiles :
+            print("== "+outfile)
+            print_results(evaluator.score_file(outfile))
+            print()
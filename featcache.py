@@ -0,0 +1,252 @@
+#####################################################
+## Persistent cache of sentence tokens and features
+#####################################################
+##
+## SQLite table sentence key -> (tokens, features), where the key is
+## the hash of the sentence text and of a context string with all
+## that may change the features of a given text (feature extractor
+## version, tokenizer, DrugBank lexicon...).  Repeated sentences, in
+## the same run or in later ones, skip tokenization and extraction.
+##
+## Strings (forms and features) are stored once, in a string table
+## kept in memory, and sentences as arrays of string ids:
+##    ntok, then for each token: form, start, end, nfeat, features
+## so that loading a sentence creates no new strings.  String ids are
+## never reused, so that a string table loaded earlier stays valid.
+##
+## The size of the cache (sentences and strings) is bounded: when it
+## grows over max_bytes, least recently used sentences are evicted,
+## and then the strings no remaining sentence uses.
+##
+## Lookups may be done in several processes (e.g. extract-features.py
+## workers), but new entries are written by one of them only: workers
+## send what they found with take(), and the writer adds it with
+## merge() and stores it with flush().
+
+import time
+import sqlite3
+import hashlib
+from array import array
+
+class FeatureCache :
+
+    def __init__(self, dbfile, context, max_bytes=1 << 30) :
+        self.db = sqlite3.connect(dbfile, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")  # only taken by new files
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS strings (id INTEGER PRIMARY KEY, s TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sentences (key BLOB PRIMARY KEY, value BLOB NOT NULL, used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sentences_used ON sentences (used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.context = hashlib.sha1(context.encode("utf-8")).digest()
+        self.max_bytes = max_bytes
+        (self.hits, self.misses, self.evicted) = (0, 0, 0)
+        self.new = {}     # key -> (tokens, features), not yet stored
+        self.used = set() # keys of stored sentences found since last flush
+        self.strings = {} # id -> string
+        self.last = -1    # last id loaded
+        self.ids = None   # string -> id, only needed (and built) by the writer
+        self.load_strings()
+        self.size = self.stored_size()
+
+    ## strings added to the table since it was loaded
+    def load_strings(self) :
+        for (i, s) in self.db.execute("SELECT id, s FROM strings WHERE id > ? ORDER BY id", (self.last,)) :
+            self.strings[i] = s
+            self.last = i
+            if self.ids is not None : self.ids[s] = i
+
+    ## bytes of stored sentences and strings
+    def stored_size(self) :
+        return (self.db.execute("SELECT COALESCE(SUM(LENGTH(value)),0) FROM sentences").fetchone()[0] +
+                self.db.execute("SELECT COALESCE(SUM(LENGTH(CAST(s AS BLOB))),0) FROM strings").fetchone()[0])
+
+    def key(self, text) :
+        return hashlib.sha1(self.context + text.encode("utf-8")).digest()
+
+    ## --------------------------------------------------
+    ## (tokens, features) stored for each of given sentence texts, or
+    ## None for those not found.  Stored sentences are looked up with
+    ## one query per 500 texts.
+    ## --------------------------------------------------
+    def get_many(self, texts) :
+        keys = [self.key(text) for text in texts]
+        stored = {}
+        missing = list(set(k for k in keys if k not in self.new))
+        for b in range(0, len(missing), 500) :
+            batch = missing[b:b+500]
+            query = "SELECT key, value FROM sentences WHERE key IN (" + ",".join("?"*len(batch)) + ")"
+            stored.update(self.db.execute(query, batch).fetchall())
+
+        result = []
+        for key in keys :
+            if key in self.new :
+                (tokens, features) = self.new[key]
+                result.append((list(tokens), [list(f) for f in features]))
+            elif key in stored :
+                self.used.add(key)
+                a = array("i")
+                a.frombytes(stored[key])
+                try :
+                    result.append(self.decode(a))
+                except KeyError :
+                    # uses strings added by the writer since they were loaded
+                    self.load_strings()
+                    result.append(self.decode(a))
+            else :
+                result.append(None)
+        found = sum(1 for r in result if r is not None)
+        self.hits += found
+        self.misses += len(result) - found
+        return result
+
+    def get(self, text) :
+        return self.get_many([text])[0]
+
+    def decode(self, a) :
+        strings = self.strings
+        tokens = []
+        features = []
+        p = 1
+        for k in range(a[0]) :
+            (form, start, end, n) = a[p:p+4]
+            tokens.append((strings[form], start, end))
+            features.append([strings[i] for i in a[p+4:p+4+n]])
+            p += 4+n
+        return tokens, features
+
+    def put(self, text, tokens, features) :
+        self.new[self.key(text)] = (tokens, features)
+
+    ## --------------------------------------------------
+    ## New entries and counters since last call, to be merged
+    ## in the writer process
+    ## --------------------------------------------------
+    def take(self) :
+        found = (self.new, self.used, self.hits, self.misses)
+        (self.new, self.used, self.hits, self.misses) = ({}, set(), 0, 0)
+        return found
+
+    def merge(self, found) :
+        (new, used, hits, misses) = found
+        self.new.update(new)
+        self.used |= used
+        self.hits += hits
+        self.misses += misses
+
+    ## --------------------------------------------------
+    ## Store new entries, update use times, and evict least
+    ## recently used sentences if needed.  String ids are given
+    ## inside the write transaction, after loading those added by
+    ## other writers, from the next id kept in the meta table
+    ## --------------------------------------------------
+    def flush(self) :
+        if not self.new and not self.used : return
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        added = []
+        try :
+            if self.ids is None : self.ids = { s : i for (i, s) in self.strings.items() }
+            self.load_strings()
+            row = self.db.execute("SELECT value FROM meta WHERE key='next_id'").fetchone()
+            nextid = row[0] if row else self.last+1
+
+            def intern(s) :
+                nonlocal nextid
+                i = self.ids.get(s)
+                if i is None :
+                    i = self.ids[s] = nextid
+                    self.strings[i] = s
+                    added.append(i)
+                    nextid += 1
+                return i
+
+            rows = []
+            for key, (tokens, features) in self.new.items() :
+                a = array("i", [len(tokens)])
+                for ((w, start, end), feats) in zip(tokens, features) :
+                    a.extend([intern(w), start, end, len(feats)])
+                    a.extend([intern(f) for f in feats])
+                rows.append((key, a.tobytes(), now))
+
+            self.db.executemany("INSERT INTO strings VALUES (?,?)", [(i, self.strings[i]) for i in added])
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('next_id', ?)", (nextid,))
+            self.db.executemany("INSERT OR REPLACE INTO sentences VALUES (?,?,?)", rows)
+            self.db.executemany("UPDATE sentences SET used=? WHERE key=?", [(now, key) for key in self.used])
+            self.db.execute("COMMIT")
+        except BaseException :
+            self.db.execute("ROLLBACK")
+            for i in added : del self.strings[i]
+            self.ids = None
+            raise
+
+        if added : self.last = max(self.last, added[-1])
+        self.size += sum(len(value) for (key, value, now) in rows)
+        self.size += sum(len(self.strings[i].encode("utf-8")) for i in added)
+        (self.new, self.used) = ({}, set())
+        if self.size > self.max_bytes : self.evict()
+
+    ## --------------------------------------------------
+    ## Remove least recently used sentences, and then the strings
+    ## they alone used, until the cache is down to 90% of the limit
+    ## --------------------------------------------------
+    def evict(self) :
+        self.size = self.stored_size()
+        if self.size <= self.max_bytes : return
+
+        target = int(0.9*self.max_bytes)
+        while self.size > target :
+            # oldest sentences covering the excess (freed strings are a bonus)
+            excess = self.size - target
+            old = []
+            for (key, size) in self.db.execute("SELECT key, LENGTH(value) FROM sentences ORDER BY used") :
+                old.append((key,))
+                excess -= size
+                if excess <= 0 : break
+
+            self.db.execute("BEGIN IMMEDIATE")
+            try :
+                self.db.executemany("DELETE FROM sentences WHERE key=?", old)
+                self.collect_strings()
+                self.db.execute("COMMIT")
+            except BaseException :
+                self.db.execute("ROLLBACK")
+                self.ids = None
+                raise
+            self.evicted += len(old)
+            self.size = self.stored_size()
+            if not old : break
+        # give the freed pages back
+        self.db.execute("PRAGMA incremental_vacuum")
+
+    ## delete strings not used by any stored sentence (inside a transaction)
+    def collect_strings(self) :
+        used = set()
+        for (value,) in self.db.execute("SELECT value FROM sentences") :
+            a = array("i")
+            a.frombytes(value)
+            p = 1
+            for k in range(a[0]) :
+                n = a[p+3]
+                used.add(a[p])
+                used.update(a[p+4:p+4+n])
+                p += 4+n
+
+        unused = [i for (i,) in self.db.execute("SELECT id FROM strings") if i not in used]
+        self.db.executemany("DELETE FROM strings WHERE id=?", [(i,) for i in unused])
+        for i in unused :
+            s = self.strings.pop(i, None)
+            if self.ids is not None and s is not None : self.ids.pop(s, None)
+
+    def stats(self) :
+        (entries,) = self.db.execute("SELECT COUNT(*) FROM sentences").fetchone()
+        (strings,) = self.db.execute("SELECT COUNT(*) FROM strings").fetchone()
+        lookups = self.hits + self.misses
+        return { "hits" : self.hits, "misses" : self.misses,
+                 "hit_rate" : self.hits/lookups if lookups else 0,
+                 "evicted" : self.evicted, "entries" : entries, "strings" : strings,
+                 "bytes" : self.stored_size() }
+
+    def close(self) :
+        self.flush()
+        self.db.close()
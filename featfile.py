@@ -0,0 +1,194 @@
+#####################################################
+## Readers and writers for feature files (.feat)
+#####################################################
+##
+## Two formats are supported:
+##
+##  - text: one line per token, with TAB separated fields
+##          sid, form, span_start, span_end, tag, feature_1 ... feature_N
+##    and a blank line after each sentence.
+##
+##  - binary: MAGIC, followed by a header and a set of columns.
+##    All strings (sentence ids, forms, tags and features) are stored
+##    once in a string table, and referred to by their index:
+##       header    : byte order, and sizes of the columns below
+##       strings   : utf-8 string table, '\n' separated
+##       sentences : index of first token of each sentence (nsent+1)
+##       sids      : string id of each sentence id
+##       forms, starts, ends, tags : one entry per token
+##       featoffs  : index of first feature of each token (ntok+1)
+##       feats     : string ids of the features of all tokens
+##
+## Readers yield one (toks, tags, xseq) triple per sentence, where toks
+## is a list of [sid, form, span_start, span_end] (as strings), tags
+## the list of token tags, and xseq the list of token feature lists.
+
+import sys
+from array import array
+from itertools import chain
+
+import compressed
+
+MAGIC = b"DDIFEAT\x01"
+
+## --
+## -- Read sentences from a text feature file, given as an iterable of
+## -- (bytes) lines
+## --
+
+def read_text(lines) :
+    toks = []
+    tags = []
+    xseq = []
+
+    for line in lines :
+        line = line.decode("utf-8").rstrip("\r\n")
+        if not line:
+            # An empty line means the end of a sentence.
+            # Return accumulated sequences, and reinitialize.
+            yield toks, tags, xseq
+            toks = []
+            tags = []
+            xseq = []
+            continue
+
+        # Split the line with TAB characters.
+        # fields are:  0=sid, 1=form, 2=span_start, 3=span_end, 4=tag, 5...N = features
+        fields = line.split('\t')
+        toks.append(fields[0:4])
+        tags.append(fields[4])
+        xseq.append(fields[5:])
+
+
+## --
+## -- Read sentences from a binary feature file (positioned after MAGIC)
+## --
+
+def read_binary(f) :
+
+    def column(typecode, n) :
+        a = array(typecode)
+        a.fromfile(f, n)
+        if swap : a.byteswap()
+        return a
+
+    swap = f.read(1).decode("ascii") != sys.byteorder[0]
+    (nbytes, nsent, ntok, nfeat) = column("q", 4)
+    strings = f.read(nbytes).decode("utf-8").split("\n")
+    sentences = column("q", nsent+1)
+    sids = column("I", nsent)
+    forms = column("I", ntok)
+    starts = column("i", ntok)
+    ends = column("i", ntok)
+    tagids = column("I", ntok)
+    featoffs = column("q", ntok+1)
+    feats = column("I", nfeat)
+
+    for s in range(nsent) :
+        sid = strings[sids[s]]
+        toks = []
+        tags = []
+        xseq = []
+        for i in range(sentences[s], sentences[s+1]) :
+            toks.append([sid, strings[forms[i]], str(starts[i]), str(ends[i])])
+            tags.append(strings[tagids[i]])
+            xseq.append([strings[j] for j in feats[featoffs[i]:featoffs[i+1]]])
+        yield toks, tags, xseq
+
+
+## --
+## -- Read sentences from given binary stream (e.g. sys.stdin.buffer),
+## -- in text or binary format, possibly compressed (see compressed.py)
+## --
+
+def instances(f) :
+    f = compressed.reader(f)
+    head = f.read(len(MAGIC))
+    if head == MAGIC :
+        return read_binary(f)
+    else :
+        return read_text(text_lines(head, f))
+
+
+## --
+## -- (bytes) lines of stream f, whose first bytes (head) were already
+## -- read to check the format
+## --
+
+def text_lines(head, f) :
+    return chain((head + f.readline()).splitlines(keepends=True), f)
+
+
+## --
+## -- Writer for text feature files
+## --
+
+class TextWriter :
+
+    def __init__(self, f) :
+        self.f = f
+
+    ## toks is a list of (sid, form, span_start, span_end) tuples
+    def add(self, toks, tags, xseq) :
+        lines = []
+        for ((sid, form, start, end), tag, feats) in zip(toks, tags, xseq) :
+            lines.append("\t".join([sid, form, str(start), str(end), tag, "\t".join(feats)])+"\n")
+        lines.append("\n")
+        self.f.write("".join(lines).encode("utf-8"))
+
+    def close(self) :
+        self.f.flush()
+
+
+## --
+## -- Writer for binary feature files.  Columns are kept in memory and
+## -- written to the file on close()
+## --
+
+class BinaryWriter :
+
+    def __init__(self, f) :
+        self.f = f
+        self.ids = {}
+        self.strings = []
+        self.sentences = array("q", [0])
+        self.sids = array("I")
+        self.forms = array("I")
+        self.starts = array("i")
+        self.ends = array("i")
+        self.tags = array("I")
+        self.featoffs = array("q", [0])
+        self.feats = array("I")
+
+    def intern(self, s) :
+        i = self.ids.get(s)
+        if i is None :
+            i = self.ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    ## toks is a list of (sid, form, span_start, span_end) tuples
+    def add(self, toks, tags, xseq) :
+        sid = toks[0][0] if toks else ""
+        self.sids.append(self.intern(sid))
+        for ((sid, form, start, end), tag, feats) in zip(toks, tags, xseq) :
+            self.forms.append(self.intern(form))
+            self.starts.append(int(start))
+            self.ends.append(int(end))
+            self.tags.append(self.intern(tag))
+            self.feats.extend([self.intern(ft) for ft in feats])
+            self.featoffs.append(len(self.feats))
+        self.sentences.append(len(self.forms))
+
+    def close(self) :
+        strings = "\n".join(self.strings).encode("utf-8")
+        self.f.write(MAGIC)
+        self.f.write(sys.byteorder[0].encode("ascii"))
+        array("q", [len(strings), len(self.sids), len(self.forms), len(self.feats)]).tofile(self.f)
+        self.f.write(strings)
+        for a in [self.sentences, self.sids, self.forms, self.starts, self.ends, self.tags, self.featoffs, self.feats] :
+            a.tofile(self.f)
+        self.f.flush()
+
+
+FORMATS = { "text" : TextWriter, "bin" : BinaryWriter }
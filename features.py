@@ -0,0 +1,406 @@
+#####################################################
+## Token feature extraction for the NER taggers
+#####################################################
+
+from functools import lru_cache
+
+import profiler
+
+## --------- Resources -----------
+## -- Affixes and terms used by the feature extractor, and DrugBank
+## -- lexicon (set with set_lexicon before extracting features)
+
+prefixes = ['acetyl', 'amino', 'anti', 'azo', 'bromo', 'cyclo', 'deoxy', 'di', 'dihydro', 'erythro', 'fluoro', 'hydroxy', 'iso', 'lipo', 'meta', 'methyl', 'neo', 'ortho', 'para', 'phenyl', 'phospho', 'pro', 'pyrro', 'sulfo', 'thio', 'trans', 'tri']
+suffixes = ['amine', 'azole', 'cillin', 'cycline', 'dazole', 'dine', 'dronate', 'fenac', 'fil', 'floxacin', 'gliptin', 'ine', 'lamide', 'mab', 'nib', 'ol', 'oprazole', 'oxacin', 'parin', 'phylline', 'prazole', 'ridone', 'sartan', 'setron', 'statin', 'tidine', 'triptan', 'vastatin', 'vir', 'zepam', 'zide', 'zole']
+
+termsForGroups = ['drugs', 'medicines', 'agents', 'supplements', 'medications', 'products', 'preparation', 'agonists', 'adjuvants', 'antagonists', 'blockers', 'inhibitors']
+symbols = ["[","]","(",")","{","}","-","_"]
+
+lookupDrugs = None
+
+# whether to extract also the feature groups not used by default (see GROUPS)
+allGroups = False
+
+# Gazetteer matching multi-word DrugBank names, if gazetteer features are wanted
+gazetteer = None
+
+# maximum number of distinct token forms whose features are kept in memory
+CACHE_SIZE = 200000
+
+# version of the extracted features, to be changed whenever they change
+# (it is part of the key of stored features, see featcache.py)
+VERSION = "1"
+
+def set_lexicon(lexicon):
+    global lookupDrugs, charClasses
+    lookupDrugs = lexicon
+    # cached records include DrugBank lookups, forget them, and start
+    # char classes cold too, so that each setting is measured alike
+    form_features.cache_clear()
+    word_features.cache_clear()
+    charClasses = {}
+
+def set_gazetteer(g):
+    global gazetteer
+    gazetteer = g
+
+def set_all_groups(flag):
+    global allGroups
+    allGroups = flag
+    form_features.cache_clear()
+    word_features.cache_clear()
+
+
+## --------- Feature groups -----------
+## -- Each feature belongs to a group, given by its name (the part
+## -- before "=").  Extraction emits the DEFAULT groups, or all of them
+## -- (set_all_groups), and train/predict scripts may keep only some
+## -- groups of the extracted features (see group_filter), so that
+## -- trying a group out does not need a new extraction.
+
+GROUPS = { "form" : ["form", "formPrev", "formPrev2", "formPrev3", "formNext", "formNext2"],
+           "suffix" : ["suf3", "suf6", "suf3Prev", "suf6Prev", "suf3Prev2", "suf3Prev3", "suf3Next", "suf3Next2"],
+           "case" : ["lowercase", "uppercase", "camelcase", "firstuppercase"],
+           "affix" : ["hasPrefix", "hasSuffix"],
+           "length" : ["len", "longToken", "lenPrev", "lenPrev2", "lenPrev3", "lenNext", "lenNext2"],
+           "drugbank" : ["inDB"+kind for kind in ["drug", "brand", "group", "drug_n"]],
+           "numbers" : ["hasNumbers", "isNumbers", "hasNumbersPrev", "hasNumbersPrev2", "hasNumbersPrev3",
+                        "hasNumbersNext", "hasNumbersNext2"],
+           "symbols" : ["hasSymbols", "isAlphaNum"],
+           "boundary" : ["BoS", "EoS"],
+           # groups extracted only with set_all_groups
+           "dashes" : ["hasDashes", "hasOpenPar", "hasClosePar"],
+           "numSymbols" : ["numDash", "numOpenPar", "numClosePar"],
+           "numXYZ" : ["numX", "numY", "numZ"],
+           "ratioCaps" : ["ratioCaps"],
+           "groupTerm" : ["hasGroupTerm", "hasGroupTermNext"],
+           "windowAffix" : ["hasPrefixPrev", "hasSuffixPrev", "hasPrefixNext", "hasSuffixNext",
+                            "hasPrefixNext2", "hasSuffixNext2"],
+           "windowSymbols" : ["hasSymbolsPrev", "hasSymbolsNext", "hasSymbolsNext2"],
+           # group extracted only with set_gazetteer
+           "gazetteer" : ["gaz"+kind for kind in ["drug", "brand", "group", "drug_n"]] }
+
+DEFAULT = ["form", "suffix", "case", "affix", "length", "drugbank", "numbers", "symbols", "boundary"]
+
+GROUP_OF = { name : group for group in GROUPS for name in GROUPS[group] }
+
+## group of a feature. Features of unknown name (e.g. DrugBank types
+## other than the usual ones) are in the group of their name prefix,
+## or in group "other"
+def feature_group(feat):
+    name = feat.split("=", 1)[0]
+    group = GROUP_OF.get(name)
+    if group is None :
+        if name.startswith("inDB") : group = "drugbank"
+        elif name.startswith("gaz") : group = "gazetteer"
+        else : group = "other"
+    return group
+
+
+## --
+## -- List of groups from a comma separated list of group names, where
+## -- "default" stands for the DEFAULT groups and "all" for all of them
+## --
+
+def parse_groups(names):
+    groups = []
+    for name in names.split(",") :
+        if name == "all" : groups += list(GROUPS) + ["other"]
+        elif name == "default" : groups += DEFAULT
+        elif name in GROUPS or name == "other" : groups.append(name)
+        else : raise ValueError("Unknown feature group '"+name+"'. Known groups: "+", ".join(GROUPS))
+    return groups
+
+
+## --
+## -- Function removing from a sentence (list of token feature lists)
+## -- the features not in 'include' groups (if given) or in 'exclude'
+## -- groups. Both are comma separated lists (see parse_groups).
+## -- Returns None if there is nothing to filter.
+## --
+
+def group_filter(include=None, exclude=None):
+    if not include and not exclude : return None
+    keep_groups = set(parse_groups(include) if include else list(GROUPS) + ["other"])
+    if exclude : keep_groups -= set(parse_groups(exclude))
+
+    keep = {}  # feature -> whether it is kept
+    def select(xseq):
+        result = []
+        for feats in xseq :
+            kept = []
+            for f in feats :
+                k = keep.get(f)
+                if k is None : k = keep[f] = feature_group(f) in keep_groups
+                if k : kept.append(f)
+            result.append(kept)
+        return result
+    return select
+
+
+## --------- get tag -----------
+##  Find out whether given token is marked as part of an entity in the XML
+
+def get_tag(token, spans) :
+    (form,start,end) = token
+    for (spanS,spanE,spanT) in spans :
+        if start==spanS and end<=spanE : return "B-"+spanT
+        elif start>=spanS and end<=spanE : return "I-"+spanT
+    return "O"
+
+## --------- Character classes -----------
+## -- Orthographic flags of a token, as a tuple (in CLASSES order) of
+## -- the values the scalar functions below give.  Flags are computed
+## -- for a whole batch of tokens at once (prepare), with NumPy on an
+## -- array with the padded codes of ASCII tokens, and with the scalar
+## -- functions for the rest.  Prefixes and suffixes are looked up by
+## -- length in sets, instead of trying each of them.
+
+CLASSES = ["lowercase", "uppercase", "camelcase", "firstuppercase", "ratioCaps",
+           "hasNumbers", "isNumbers", "hasSymbols", "isAlphaNum"]
+
+prefixSet = set(prefixes)
+prefixLengths = sorted(set(len(p) for p in prefixes))
+suffixSet = set(suffixes)
+suffixLengths = sorted(set(len(s) for s in suffixes))
+
+# same as any(t.startswith(p) for p in prefixes): when t is shorter than
+# n, t[:n] is t itself, which is in the set only if t is a prefix
+def has_prefix(t):
+    return any(t[:n] in prefixSet for n in prefixLengths)
+
+def has_suffix(t):
+    return any(t[-n:] in suffixSet for n in suffixLengths)
+
+def isCamel(s):
+    return (s != s.lower() and s != s.upper() and "_" not in s)
+
+def isFirstCap(s):
+    return s[0].isupper() and s[1:].islower()
+
+def capitalRatio(s):
+    capitalLetters = sum(1 for c in s if c.isupper())
+    totalLetters = len(s)
+    if totalLetters == 0:
+        return 0
+    else:
+        return capitalLetters / totalLetters
+
+def char_classes_scalar(t):
+    return (t.islower(), t.isupper(), isCamel(t), isFirstCap(t), capitalRatio(t) > 0.5,
+            any(c.isdigit() for c in t), t.isdigit(), any(c in symbols for c in t), t.isalnum())
+
+# token -> flags, for tokens seen since the dictionary was last emptied
+charClasses = {}
+
+# below this number of new ASCII tokens, NumPy is not worth its overhead
+BATCH_MIN = 64
+
+def char_classes_batch(tokens):
+    import numpy as np
+
+    data = "".join(tokens).encode("ascii")
+    lengths = np.fromiter((len(t) for t in tokens), dtype=np.intp, count=len(tokens))
+    codes = np.zeros((len(tokens), lengths.max()), dtype=np.uint8)
+    rows = np.repeat(np.arange(len(tokens)), lengths)
+    cols = np.arange(len(data)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes[rows, cols] = np.frombuffer(data, dtype=np.uint8)
+
+    # padding is 0, in no class
+    upper = (codes >= ord("A")) & (codes <= ord("Z"))
+    lower = (codes >= ord("a")) & (codes <= ord("z"))
+    digit = (codes >= ord("0")) & (codes <= ord("9"))
+    nupper = upper.sum(axis=1)
+    nlower = lower.sum(axis=1)
+    ndigit = digit.sum(axis=1)
+    hasSymbol = np.isin(codes, np.frombuffer("".join(symbols).encode("ascii"), dtype=np.uint8)).any(axis=1)
+    underscore = (codes == ord("_")).any(axis=1)
+    # upper and lower counts after the first character
+    restUpper = nupper - upper[:,0]
+    restLower = nlower - lower[:,0]
+
+    flags = np.column_stack([
+        (nlower > 0) & (nupper == 0),                          # islower
+        (nupper > 0) & (nlower == 0),                          # isupper
+        (nupper > 0) & (nlower > 0) & ~underscore,             # isCamel
+        upper[:,0] & (restLower > 0) & (restUpper == 0),       # isFirstCap
+        2*nupper > lengths,                                    # capitalRatio > 0.5
+        ndigit > 0,                                            # any isdigit
+        ndigit == lengths,                                     # isdigit
+        hasSymbol,                                             # any in symbols
+        nupper + nlower + ndigit == lengths ])                 # isalnum
+    return [tuple(row) for row in flags.tolist()]
+
+## --
+## -- Compute the flags of all given token forms, and of their
+## -- lowercased forms, not seen yet.  Empty and non-ASCII tokens
+## -- (whose classes NumPy would not get right) go through the
+## -- scalar functions.
+## --
+
+def prepare(forms):
+    global charClasses
+    new = set(t for f in forms for t in (f, f.lower()) if t not in charClasses)
+    if not new : return
+    if len(charClasses) + len(new) > 2*CACHE_SIZE : charClasses = {}
+
+    batch = [t for t in new if t and t.isascii()]
+    if len(batch) >= BATCH_MIN :
+        try :
+            charClasses.update(zip(batch, char_classes_batch(batch)))
+            new.difference_update(batch)
+        except ImportError :
+            pass
+    for t in new :
+        charClasses[t] = char_classes_scalar(t)
+
+def char_classes(t):
+    flags = charClasses.get(t)
+    if flags is None :
+        flags = charClasses[t] = char_classes_scalar(t)
+    return flags
+
+
+## --------- Case-sensitive token features -----------
+## -- Features of the token as a current token that depend on its
+## -- original form. Computed once per distinct form.
+
+@lru_cache(maxsize=CACHE_SIZE)
+def form_features(t) :
+    tokenFeatures = []
+
+    ### Current token features
+    tokenFeatures.append("form="+t)
+    tokenFeatures.append("suf3="+t[-3:])
+    tokenFeatures.append("suf6="+t[-6:])
+
+    (lowercase, uppercase, camelcase, firstuppercase, ratioCaps) = char_classes(t)[:5]
+
+    # Types of cases
+    tokenFeatures.append("lowercase="+str(lowercase))
+    tokenFeatures.append("uppercase="+str(uppercase))
+    tokenFeatures.append("camelcase="+str(camelcase))
+    tokenFeatures.append("firstuppercase="+str(firstuppercase))
+
+    # Ratio of capital letters
+    if allGroups :
+        tokenFeatures.append("ratioCaps="+str(ratioCaps))
+
+    return tokenFeatures
+
+
+## --------- Lowercase token features -----------
+## -- Features depending only on the lowercased form t, for the token
+## -- itself and for each window position where it may appear.
+## -- Computed once per distinct lowercased form, and returned as
+## -- a tuple (current, prev, prev2, prev3, next, next2) of lists.
+
+@lru_cache(maxsize=CACHE_SIZE)
+def word_features(t) :
+    tokenFeatures = []
+    (hasNumbers, isNumbers, hasSymbols, isAlphaNum) = [str(f) for f in char_classes(t)[5:]]
+
+    # Has prefix or suffix
+    hasPrefix = str(has_prefix(t))
+    hasSuffix = str(has_suffix(t))
+    tokenFeatures.append("hasPrefix="+hasPrefix)
+    tokenFeatures.append("hasSuffix="+hasSuffix)
+
+    # Get length
+    tokenFeatures.append("len="+str(len(t)))
+    # Is the token large
+    tokenFeatures.append("longToken="+str(len(t)>8))
+
+    # Check lookup files V2: known name (True), word in a known name (Partial)
+    with profiler.timer("lookup") :
+        for kind in lookupDrugs.kinds:
+            tokenFeatures.append(f"inDB{kind}={lookupDrugs.match(t, kind)}")
+
+    # Numeric characters
+    tokenFeatures.append("hasNumbers="+hasNumbers)
+    tokenFeatures.append("isNumbers="+isNumbers)
+
+    ### Containes dashes or parantheses    # hasSymbols gives the same info.
+    if allGroups :
+        tokenFeatures.append("hasDashes="+str('-' in t))
+        tokenFeatures.append("hasOpenPar="+str('(' in t))
+        tokenFeatures.append("hasClosePar="+str(')' in t))
+    tokenFeatures.append("hasSymbols="+hasSymbols)
+
+    ## Number of dashes
+    if allGroups :
+        tokenFeatures.append("numDash="+str(t.count('-')))
+        tokenFeatures.append("numOpenPar="+str(t.count('(')))
+        tokenFeatures.append("numClosePar="+str(t.count(')')))
+
+    # Contains non-alphanumeric
+    tokenFeatures.append("isAlphaNum="+isAlphaNum)
+
+    ## Number of x, y and z
+    if allGroups :
+        tokenFeatures.append("numX="+str(t.count('x')))
+        tokenFeatures.append("numY="+str(t.count('y')))
+        tokenFeatures.append("numZ="+str(t.count('z')))
+
+    # Has a term useful to identify groups --> Reduces drug_n
+    hasGroupTerm = str(t in termsForGroups)
+    if allGroups :
+        tokenFeatures.append("hasGroupTerm="+hasGroupTerm)
+
+    ####################
+    ### Features of t as previous token
+
+    prev = ["formPrev="+t, "suf3Prev="+t[-3:], "suf6Prev="+t[-6:],
+            "lenPrev="+str(len(t)), "hasNumbersPrev="+hasNumbers]
+    if allGroups :
+        prev += ["hasPrefixPrev="+hasPrefix, "hasSuffixPrev="+hasSuffix, "hasSymbolsPrev="+hasSymbols]
+    prev2 = ["formPrev2="+t, "suf3Prev2="+t[-3:], "lenPrev2="+str(len(t)), "hasNumbersPrev2="+hasNumbers]
+    prev3 = ["formPrev3="+t, "suf3Prev3="+t[-3:], "lenPrev3="+str(len(t)), "hasNumbersPrev3="+hasNumbers]
+
+    ### Features of t as next token
+
+    nxt = ["formNext="+t, "suf3Next="+t[-3:], "lenNext="+str(len(t)), "hasNumbersNext="+hasNumbers]
+    nxt2 = ["formNext2="+t, "suf3Next2="+t[-3:], "lenNext2="+str(len(t)), "hasNumbersNext2="+hasNumbers]
+    if allGroups :
+        nxt += ["hasGroupTermNext="+hasGroupTerm, "hasPrefixNext="+hasPrefix,
+                "hasSuffixNext="+hasSuffix, "hasSymbolsNext="+hasSymbols]
+        nxt2 += ["hasPrefixNext2="+hasPrefix, "hasSuffixNext2="+hasSuffix, "hasSymbolsNext2="+hasSymbols]
+
+    return (tokenFeatures, prev, prev2, prev3, nxt, nxt2)
+
+
+## --------- Feature extractor -----------
+## -- Extract features for each token in given sentence, assembling
+## -- the window from the cached records of the neighbour tokens
+
+def extract_features(tokens) :
+
+    forms = [tk[0] for tk in tokens]
+    words = [word_features(f.lower()) for f in forms]
+    n = len(tokens)
+
+    # for each token, generate list of features and add it to the result
+    result = []
+    for k in range(0,n):
+        tokenFeatures = form_features(forms[k]) + words[k][0]
+
+        ### Previous token features
+        if k>0 : tokenFeatures += words[k-1][1]
+        else : tokenFeatures.append("BoS")
+        if k>1 : tokenFeatures += words[k-2][2]
+        if k>2 : tokenFeatures += words[k-3][3]
+
+        ### Next token features
+        if k<n-1 : tokenFeatures += words[k+1][4]
+        else : tokenFeatures.append("EoS")
+        if k<n-2 : tokenFeatures += words[k+2][5]
+
+        result.append(tokenFeatures)
+
+    ### Gazetteer features: multi-word DrugBank names found in the sentence
+    if gazetteer is not None :
+        with profiler.timer("gazetteer") :
+            for tokenFeatures, gaz in zip(result, gazetteer.features(forms)) :
+                tokenFeatures += gaz
+
+    return result
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+from queue import Queue, Empty
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from socketserver import TCPServer
+
+import featfile
+from ML_model import ML_model, decode
+from tokenizer import TOKENIZERS
+from features import extract_features, set_lexicon, set_gazetteer
+
+
+## --
+## -- A request waiting in the batcher queue: list of (xseq,toks)
+## -- sentences, and the place to leave its predicted entities
+## --
+
+class Job:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.entities = None
+        self.error = None
+        self.done = threading.Event()
+
+
+## --
+## -- Micro-batcher: a single thread owns the model, and tags the
+## -- sentences of all requests arrived within max_wait seconds of
+## -- each other (up to max_batch sentences) in one predict_batch call.
+## --
+
+class Batcher:
+
+    def __init__(self, model, max_batch, max_wait):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = Queue()
+
+        # counters for /stats
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.nrequests = 0
+        self.nsentences = 0
+        self.nbatches = 0
+        self.latencies = deque(maxlen=10000)
+
+        threading.Thread(target=self.run, daemon=True).start()
+
+    ## called from request threads: wait until the job is tagged
+    def tag(self, sentences):
+        start = time.perf_counter()
+        job = Job(sentences)
+        self.queue.put(job)
+        job.done.wait()
+        with self.lock:
+            self.nrequests += 1
+            self.latencies.append(time.perf_counter() - start)
+        if job.error is not None: raise job.error
+        return job.entities
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            size = len(batch[0].sentences)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0: break
+                try:
+                    job = self.queue.get(timeout=timeout)
+                except Empty:
+                    break
+                batch.append(job)
+                size += len(job.sentences)
+
+            try:
+                self.tag_jobs(batch)
+            except Exception:
+                # find out which requests fail, tagging each one on its own
+                for job in batch:
+                    try:
+                        self.tag_jobs([job])
+                    except Exception as e:
+                        job.error = e
+            for job in batch:
+                job.done.set()
+
+            with self.lock:
+                self.nbatches += 1
+                self.nsentences += size
+
+    ## tag the sentences of all given jobs with one predict_batch call
+    def tag_jobs(self, jobs):
+        sentences = [(job, xseq, toks) for job in jobs for xseq, toks in job.sentences if len(xseq) > 0]
+        predictions = self.model.predict_batch([xseq for job, xseq, toks in sentences])
+        for job in jobs:
+            job.entities = []
+        for (job, xseq, toks), y in zip(sentences, predictions):
+            job.entities.extend(decode(toks, y))
+
+    def stats(self):
+        with self.lock:
+            lat = sorted(self.latencies)
+            elapsed = time.time() - self.started
+            pct = lambda p: 1000*lat[min(len(lat)-1, int(p*len(lat)))] if lat else 0
+            return { "requests" : self.nrequests,
+                     "sentences" : self.nsentences,
+                     "batches" : self.nbatches,
+                     "avg_batch" : self.nsentences/self.nbatches if self.nbatches else 0,
+                     "p50_ms" : pct(0.50),
+                     "p99_ms" : pct(0.99),
+                     "sentences_per_sec" : self.nsentences/elapsed if elapsed else 0,
+                     "uptime_sec" : elapsed }
+
+
+## --
+## -- Convert a request body into a list of (xseq,toks) sentences.
+## -- The body is a JSON object with either:
+## --    "sentences" : [ {"id": sid, "text": sentence}, ... ]   (raw text)
+## --    "features"  : contents of a text feature file (.feat)
+## --
+
+def parse_request(body, tokenize):
+    req = json.loads(body)
+    sentences = []
+    if "sentences" in req:
+        if tokenize is None:
+            raise ValueError("raw sentences need the server to be started with --drugbank")
+        for s in req["sentences"]:
+            tokens = tokenize(s["text"])
+            toks = [[s["id"], w, str(start), str(end)] for (w, start, end) in tokens]
+            sentences.append((extract_features(tokens), toks))
+    if "features" in req:
+        lines = req["features"].encode("utf-8").splitlines(keepends=True)
+        for toks, tags, xseq in featfile.read_text(lines):
+            sentences.append((xseq, toks))
+    return sentences
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    def reply(self, code, ctype, text):
+        data = text.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.reply(200, "application/json", json.dumps(self.server.batcher.stats()))
+        else:
+            self.reply(404, "text/plain", "Unknown path\n")
+
+    def do_POST(self):
+        if self.path != "/tag":
+            self.reply(404, "text/plain", "Unknown path\n")
+            return
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            sentences = parse_request(body, self.server.tokenize)
+        except (ValueError, KeyError, TypeError) as e:
+            self.reply(400, "text/plain", "Bad request: "+str(e)+"\n")
+            return
+        try:
+            entities = self.server.batcher.tag(sentences)
+        except Exception as e:
+            self.reply(500, "text/plain", "Tagging failed: "+str(e)+"\n")
+            return
+        # same output as predict.py: sid|start-end|text|type
+        self.reply(200, "text/plain", "".join("|".join(e)+"\n" for e in entities))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+class UnixHTTPServer(Server):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def get_request(self):
+        (request, address) = self.socket.accept()
+        return request, ("local", 0)
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  predict-server.py model [--port P | --socket path] [--drugbank DrugBank.txt]
+## --
+## -- Loads model once and serves NER predictions over HTTP (on a TCP
+## -- port or a Unix socket):
+## --    POST /tag    JSON body with raw "sentences" or pre-extracted
+## --                 "features", returns sid|start-end|text|type lines
+## --    GET  /stats  request/sentence counters, p50/p99 latency, throughput
+## -- Raw sentences are tokenized and featurized as in extract-features.py,
+## -- which needs the DrugBank lexicon.  Use --gazetteer if the model was
+## -- trained on features extracted with --gazetteer.
+## --
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", help="model file (any type known to ML_model)")
+    parser.add_argument("--vectorizer", help="vectorizer file, for sklearn models")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--socket", help="serve on this Unix socket instead of TCP")
+    parser.add_argument("--drugbank", help="DrugBank.txt, needed to accept raw sentences")
+    parser.add_argument("--tokenizer", default="nltk", choices=sorted(TOKENIZERS), help="tokenizer for raw sentences")
+    parser.add_argument("--gazetteer", action="store_true", help="add gazetteer features to raw sentences")
+    parser.add_argument("--max-batch", type=int, default=64, help="max sentences per batch")
+    parser.add_argument("--max-wait", type=float, default=5, help="max ms to wait for a batch to fill")
+    args = parser.parse_args()
+
+    # load learned model
+    model = ML_model(args.model, **({ "vectorizer" : args.vectorizer } if args.vectorizer else {}))
+
+    tokenize = None
+    if args.drugbank:
+        from Lexicon import Lexicon
+        lexicon = Lexicon.load(args.drugbank)
+        set_lexicon(lexicon)
+        if args.gazetteer:
+            from Gazetteer import Gazetteer
+            set_gazetteer(Gazetteer.load(lexicon, args.drugbank, args.tokenizer))
+        tokenize = TOKENIZERS[args.tokenizer]
+
+    if args.socket:
+        server = UnixHTTPServer(args.socket, Handler)
+    else:
+        server = Server((args.host, args.port), Handler)
+    server.batcher = Batcher(model, args.max_batch, args.max_wait/1000)
+    server.tokenize = tokenize
+
+    print("Serving", args.socket or "http://%s:%d" % (args.host, args.port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
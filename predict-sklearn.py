@@ -1,83 +1,78 @@
 #!/usr/bin/env python3
 
 import sys
-from joblib import dump, load
-from sklearn.feature_extraction import DictVectorizer
+import argparse
+import features
+import profiler
+from NB import NB
+from ML_model import decode
+from predict import instances
+from compressed import CODECS, open_text_output
 
-def instances(fi):
-    xseq = []
-    toks = []
-    
-    for line in fi:
-        line = line.strip('\n')
-        if not line:
-            # An empty line means the end of a sentence.
-            # Return accumulated sequences, and reinitialize.
-            yield xseq, toks
-            xseq = []
-            toks = []
-            continue
 
-        # Split the line with TAB characters.
-        fields = line.split('\t')
-        # Append the item features to the item sequence.
-        # fields are:  0=sid, 1=form, 2=span_start, 3=span_end, 4=tag, 5...N = features
-        item = fields[5:]        
-        xseq.append(item)
+def predict_batch(model, batch, out):
+	# predict all sentences in the batch at once, and print their entities
+	predictions = model.predict_batch([xseq for xseq, toks in batch])
+	with profiler.timer("write"):
+		for (xseq, toks), y in zip(batch, predictions):
+			entities = decode(toks, y)
+			profiler.count("entities", len(entities))
+			for e in entities:
+				print(*e, sep="|", file=out)
+	profiler.count("batches")
 
-        # Append token information (needed to produce the appropriate output)
-        toks.append([fields[0],fields[1],fields[2],fields[3]])
-
-
-def fix_format(token):
-	if 'BoS' in token:
-		token = token.replace('BoS','formPrev=BoS	suf3Prev=BoS')
-	if 'EoS' in token:
-		token = token.replace('EoS','formNext=EoS	suf3Next=EoS')
-	return token
-
-
-
-def prepare_instances(xseq):
-	features = []
-	for token in xseq:
-		token = fix_format('\t'.join(token)).split('\t')
-		token_dict = {feat.split('=')[0]:feat.split('=')[1] for feat in token[1:]}
-		features.append(token_dict)
-	return features
 
+## --
+## -- Usage:  predict-sklearn.py [--batch-size B] [--groups G,...] [--exclude-groups G,...]
+## --                           [-o FILE] [--compress gzip|zstd|lz4] model vectorizer < features
+## --
+## -- Sentences are vectorized and predicted in batches of B sentences
+## -- (see NB.py).
+## -- --groups/--exclude-groups keep only some feature groups of the input,
+## -- and should be those the model was trained with (see train-sklearn.py)
+## -- Input may be compressed.  -o FILE writes to FILE instead of stdout,
+## -- compressed by extension or with --compress (see compressed.py)
+## -- --profile REPORT writes stage timers and counters to REPORT (JSON,
+## -- "-" for stderr) at exit, --cprofile FILE also dumps cProfile stats
+## -- (see profiler.py)
+## --
 
 if __name__ == '__main__':
 
-    # load leaned model and DictVectorizer
-	model = load(sys.argv[1])
-	v  = load(sys.argv[2]) 
+	parser = argparse.ArgumentParser()
+	parser.add_argument("model", help="model file")
+	parser.add_argument("vectorizer", help="vectorizer file")
+	parser.add_argument("--batch-size", type=int, default=2000, help="sentences per batch")
+	parser.add_argument("--profile", help="write a profiling report to this file ('-' for stderr)")
+	parser.add_argument("--cprofile", help="with --profile, dump cProfile stats to this file")
+	parser.add_argument("--groups", help="comma separated feature groups to use (default: all in the input)")
+	parser.add_argument("--exclude-groups", help="comma separated feature groups to leave out")
+	parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+	parser.add_argument("--compress", choices=sorted(CODECS), help="compress output (default: by output file extension)")
+	args = parser.parse_args()
+	if args.profile: profiler.enable(args.profile, args.cprofile)
+	try:
+		select = features.group_filter(args.groups, args.exclude_groups)
+	except ValueError as e:
+		parser.error(str(e))
+
+	# load leaned model and DictVectorizer (any file names: the backend
+	# is NB, not chosen by the model file extension as in ML_model)
+	with profiler.timer("load"):
+		model = NB(args.model, vectorizer=args.vectorizer)
 
-    # Read training instances from STDIN, and send them to trainer.
-	for xseq,toks in instances(sys.stdin):
+	# Read instances from STDIN, and predict them in batches
+	out = open_text_output(args.output, args.compress)
+	batch = []
+	for xseq,toks in profiler.timed("read", instances(sys.stdin.buffer, select)):
 		if len(xseq) == 0:
 			continue
-		xseq = prepare_instances(xseq)
-		vectors = v.transform(xseq)
-		predictions = model.predict(vectors)
-
-		inside = False;
-		for k in range(0,len(predictions)) :
-			y = predictions[k]
-			(sid, form, offS, offE) = toks[k]
-			
-			if (y[0]=="B") :
-				entity_form = form
-				entity_start = offS
-				entity_end = offE
-				entity_type = y[2:]
-				inside = True
-			elif (y[0]=="I" and inside) :
-				entity_form += " "+form
-				entity_end = offE
-			elif (y[0]=="O" and inside) :
-				print(sid, entity_start+"-"+entity_end, entity_form, entity_type, sep="|")
-				inside = False
-		
-		if inside : print(sid, entity_start+"-"+entity_end, entity_form, entity_type, sep="|")
-
+		batch.append((xseq, toks))
+		profiler.count("sentences")
+		profiler.count("tokens", len(toks))
+		if len(batch) == args.batch_size:
+			predict_batch(model, batch, out)
+			batch = []
+	if batch:
+		predict_batch(model, batch, out)
+	out.close()
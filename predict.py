@@ -1,59 +1,116 @@
 #!/usr/bin/env python3
 
 import sys
-from ML_model import *
-
-def instances(fi):
-    xseq = []
-    toks = []
-    
-    for line in fi:
-        line = line.strip('\n')
-        if not line:
-            # An empty line means the end of a sentence.
-            # Return accumulated sequences, and reinitialize.
-            yield xseq, toks
-            xseq = []
-            toks = []
-            continue
-
-        # Split the line with TAB characters.
-        fields = line.split('\t')
-        # Append the item features to the item sequence.
-        # fields are:  0=sid, 1=form, 2=span_start, 3=span_end, 4=tag, 5...N = features
-        item = fields[5:]        
-        xseq.append(item)
-
-        # Append token information (needed to produce the appropriate output)
-        toks.append([fields[0],fields[1],fields[2],fields[3]])
+import argparse
+from multiprocessing import Pool
 
+import featfile
+from compressed import CODECS, open_text_output
+import features
+import profiler
+from ML_model import ML_model, decode
+
+def instances(fi, select=None):
+    # fi is a binary stream with a feature file, in text or binary format.
+    # select, if given, filters the features of each sentence (see
+    # features.group_filter)
+    for toks, tags, xseq in featfile.instances(fi):
+        yield (select(xseq) if select else xseq), toks
+
+
+## --
+## -- Tagging: sentences are tagged in chunks, with the model
+## -- predict_batch.  In parallel tagging, each worker process opens
+## -- its own model, and tags chunks of sentences
+## --
+
+model = None
+
+def init_worker(modelfile, options={}):
+    global model
+    model = ML_model(modelfile, **options)
+
+def tag_chunk(chunk):
+    with profiler.timer("tag") :
+        predictions = model.predict_batch([xseq for xseq, toks in chunk])
+    result = []
+    with profiler.timer("decode") :
+        for (xseq, toks), y in zip(chunk, predictions) :
+            result.append(decode(toks, y))
+            profiler.count("entities", len(result[-1]))
+    profiler.count("sentences", len(chunk))
+    profiler.count("tokens", sum(len(toks) for xseq, toks in chunk))
+    return result
+
+def chunks(sentences, size):
+    chunk = []
+    for s in sentences:
+        chunk.append(s)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk: yield chunk
+
+
+## --
+## -- Usage:  predict.py [--workers N] [--chunk-size C] [--vectorizer V]
+## --                   [--groups G,...] [--exclude-groups G,...]
+## --                   [-o FILE] [--compress gzip|zstd|lz4] model < features
+## --
+## -- The model may be of any type registered in ML_model (.crf, or .joblib
+## -- with its vectorizer V).  Sentences are tagged in chunks of C sentences.
+## -- With --workers N, chunks are tagged by a pool of N processes, and
+## -- printed in input order.
+## -- --groups/--exclude-groups keep only some feature groups of the input,
+## -- and should be those the model was trained with (see train-crf.py)
+## -- Input may be compressed.  -o FILE writes to FILE instead of stdout,
+## -- compressed by extension or with --compress (see compressed.py)
+## -- --profile REPORT writes stage timers and counters to REPORT (JSON,
+## -- "-" for stderr) at exit, --cprofile FILE also dumps cProfile stats
+## -- (see profiler.py)
+## --
 
 if __name__ == '__main__':
 
-    # load leaned model
-    model = ML_model(sys.argv[1])
-
-    # Read training instances from STDIN, and send them to trainer.
-    for xseq,toks in instances(sys.stdin):
-        predictions = model.predict(xseq)
-
-        inside = False;
-        for k in range(0,len(predictions)) :
-            y = predictions[k]
-            (sid, form, offS, offE) = toks[k]
-            
-            if (y[0]=="B") :	# If predicted B --> Save form, limits and type
-                entity_form = form
-                entity_start = offS
-                entity_end = offE
-                entity_type = y[2:]
-                inside = True
-            elif (y[0]=="I" and inside) : # If predicted I --> Extend form and update end limit
-                entity_form += " "+form
-                entity_end = offE
-            elif (y[0]=="O" and inside) : # If predicted O but was in insede --> Save result and set insede=F
-                print(sid, entity_start+"-"+entity_end, entity_form, entity_type, sep="|")
-                inside = False
-        
-        if inside : print(sid, entity_start+"-"+entity_end, entity_form, entity_type, sep="|")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", help="model file")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--chunk-size", type=int, default=200, help="sentences tagged at once (per worker)")
+    parser.add_argument("--vectorizer", help="vectorizer file, for sklearn models")
+    parser.add_argument("--profile", help="write a profiling report to this file ('-' for stderr)")
+    parser.add_argument("--cprofile", help="with --profile, dump cProfile stats to this file")
+    parser.add_argument("--groups", help="comma separated feature groups to use (default: all in the input)")
+    parser.add_argument("--exclude-groups", help="comma separated feature groups to leave out")
+    parser.add_argument("-o", "--output", default="-", help="output file (default: stdout)")
+    parser.add_argument("--compress", choices=sorted(CODECS), help="compress output (default: by output file extension)")
+    args = parser.parse_args()
+    if args.profile : profiler.enable(args.profile, args.cprofile)
+    try :
+        select = features.group_filter(args.groups, args.exclude_groups)
+    except ValueError as e :
+        parser.error(str(e))
+
+    options = { "vectorizer" : args.vectorizer } if args.vectorizer else {}
+    sentences = profiler.timed("read", instances(sys.stdin.buffer, select))
+    out = open_text_output(args.output, args.compress)
+    if args.workers > 1 :
+        with Pool(args.workers, initializer=init_worker, initargs=(args.model, options)) as pool :
+            for result in profiler.imap(pool, tag_chunk, chunks(sentences, args.chunk_size)) :
+                with profiler.timer("write") :
+                    for entities in result :
+                        for e in entities :
+                            print(*e, sep="|", file=out)
+
+    else :
+        # load leaned model
+        with profiler.timer("load") :
+            init_worker(args.model, options)
 
+        # Read instances from STDIN, and tag them
+        for chunk in chunks(sentences, args.chunk_size):
+            result = tag_chunk(chunk)
+            with profiler.timer("write") :
+                for entities in result :
+                    for e in entities :
+                        print(*e, sep="|", file=out)
+    out.close()
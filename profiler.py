@@ -0,0 +1,175 @@
+#####################################################
+## Opt-in instrumentation for the pipeline scripts
+#####################################################
+##
+## Enabled with --profile REPORT in the scripts, or by setting the
+## environment variable DDI_PROFILE=REPORT (REPORT is a JSON file, or
+## "-" for stderr).  When enabled, it records
+##
+##   - stage timers:  with profiler.timer("tokenize") : ...
+##     (total seconds and calls per stage; stages may be nested, e.g.
+##     "lookup" is part of "features")
+##   - counters:      profiler.count("tokens", len(tokens))
+##   - a cProfile dump of the main process, if DDI_CPROFILE=FILE is
+##     set (or --cprofile FILE is given)
+##
+## and writes them as a JSON report when the program exits.  Stats of
+## worker processes are sent back with their results (see imap) and
+## added to those of the main process.
+##
+## When disabled, timer() returns a shared no-op context manager and
+## count() returns at once, so the hooks cost a function call.
+
+import os
+import sys
+import json
+import time
+import atexit
+from contextlib import nullcontext
+
+enabled = False
+report = None
+stages = {}
+counters = {}
+started = time.perf_counter()
+cprofiler = None
+
+NULL = nullcontext()
+
+
+class Timer :
+
+    def __init__(self, name) :
+        self.name = name
+
+    def __enter__(self) :
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) :
+        st = stages.get(self.name)
+        if st is None : st = stages[self.name] = [0.0, 0]
+        st[0] += time.perf_counter() - self.start
+        st[1] += 1
+
+
+def timer(name) :
+    return Timer(name) if enabled else NULL
+
+def count(name, n=1) :
+    if enabled :
+        counters[name] = counters.get(name, 0) + n
+
+
+## --
+## -- Iterate over items, timing the production of each one as 'name'
+## -- (e.g. parsing of each sentence by a reader generator)
+## --
+
+def timed(name, items) :
+    return timed_items(name, items) if enabled else items
+
+def timed_items(name, items) :
+    it = iter(items)
+    while True :
+        with Timer(name) :
+            try :
+                item = next(it)
+            except StopIteration :
+                return
+        yield item
+
+
+## --
+## -- Stats recorded since the last call (in a worker process), and
+## -- merging of such stats (in the main process)
+## --
+
+def take() :
+    global stages, counters
+    stats = (stages, counters)
+    (stages, counters) = ({}, {})
+    return stats
+
+def merge(stats) :
+    (st, cnt) = stats
+    for name, (seconds, calls) in st.items() :
+        s = stages.setdefault(name, [0.0, 0])
+        s[0] += seconds
+        s[1] += calls
+    for name, n in cnt.items() :
+        counters[name] = counters.get(name, 0) + n
+
+
+class Collect :
+    ## func(item), returned with the stats recorded while computing it
+    def __init__(self, func) :
+        self.func = func
+
+    def __call__(self, item) :
+        result = self.func(item)
+        return result, take()
+
+
+## pool.imap(func, items), adding the stats recorded in the workers
+def imap(pool, func, items) :
+    if not enabled :
+        return pool.imap(func, items)
+    return merged(pool.imap(Collect(func), items))
+
+def merged(results) :
+    for (result, stats) in results :
+        merge(stats)
+        yield result
+
+
+## --
+## -- Enable instrumentation, with the report written to given file
+## -- ("-" for stderr) at exit.  Worker processes started later see
+## -- the same settings through the environment.
+## --
+
+def enable(reportfile="-", cprofile=None) :
+    global enabled, report, cprofiler
+    if enabled : return
+    (enabled, report) = (True, reportfile)
+    os.environ["DDI_PROFILE"] = reportfile
+    if cprofile : os.environ["DDI_CPROFILE"] = cprofile
+
+    # only the main process writes a report, workers send their stats back
+    if is_main() :
+        if cprofile :
+            import cProfile
+            cprofiler = cProfile.Profile()
+            cprofiler.enable()
+        atexit.register(write_report)
+        # forked workers start with no stats of their own
+        os.register_at_fork(after_in_child=take)
+
+
+def is_main() :
+    import multiprocessing
+    return multiprocessing.parent_process() is None
+
+
+def write_report() :
+    wall = time.perf_counter() - started
+    if cprofiler is not None :
+        cprofiler.disable()
+        cprofiler.dump_stats(os.environ["DDI_CPROFILE"])
+
+    data = { "program" : os.path.basename(sys.argv[0]),
+             "argv" : sys.argv[1:],
+             "wall_seconds" : wall,
+             "stages" : { name : { "seconds" : s, "calls" : n } for name, (s, n) in sorted(stages.items()) },
+             "counters" : dict(sorted(counters.items())),
+             "per_second" : { name : n/wall for name, n in sorted(counters.items()) } if wall else {} }
+    if report == "-" :
+        json.dump(data, sys.stderr, indent=2)
+        sys.stderr.write("\n")
+    else :
+        with open(report, "w") as f :
+            json.dump(data, f, indent=2)
+
+
+if os.environ.get("DDI_PROFILE") :
+    enable(os.environ["DDI_PROFILE"], os.environ.get("DDI_CPROFILE"))
@@ -0,0 +1,280 @@
+#! /usr/bin/python3
+
+import io
+import os
+import sys
+import ast
+import json
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from compressed import CODECS, open_input, open_text_output
+from ML_model import BACKENDS
+
+## --
+## -- Incremental driver for the extract -> train -> predict -> evaluate
+## -- pipeline (what run.sh and run.test.sh do).
+## --
+## -- Each stage is fingerprinted with its command, its input files
+## -- (corpus, DrugBank, outputs of previous stages) and the code it
+## -- runs (the script and all local modules it imports).  A stage is
+## -- skipped when its outputs exist and the fingerprint matches the
+## -- one stored in STAMPDIR by its last successful run.  Stages whose
+## -- inputs are ready run concurrently (e.g. CRF and NB tracks).
+## --
+
+CODEDIR = os.path.dirname(os.path.abspath(__file__))
+STAMPDIR = ".pipeline"
+
+
+## --
+## -- Hash of a file or directory contents.  Hashes are remembered by
+## -- (path, size, mtime), so unchanged files are not read again.
+## --
+
+hashcache = {}
+
+def file_hash(path) :
+    st = os.stat(path)
+    key = path + "|" + str(st.st_size) + "|" + str(st.st_mtime_ns)
+    if key not in hashcache :
+        h = hashlib.sha1()
+        with open(path, "rb") as f :
+            for block in iter(lambda: f.read(1 << 20), b"") :
+                h.update(block)
+        hashcache[key] = h.hexdigest()
+    return hashcache[key]
+
+def path_hash(path) :
+    if os.path.isdir(path) :
+        h = hashlib.sha1()
+        for f in sorted(os.listdir(path)) :
+            h.update((f + ":" + path_hash(os.path.join(path, f)) + "\n").encode())
+        return h.hexdigest()
+    return file_hash(path)
+
+
+## --
+## -- Local source files a script depends on: the script itself and,
+## -- recursively, all modules it imports from CODEDIR.  ML_model imports
+## -- its backends at run time, so all of them are counted with it.
+## --
+
+def code_files(script, seen=None) :
+    if seen is None : seen = set()
+    path = os.path.join(CODEDIR, script)
+    if path in seen or not os.path.exists(path) : return seen
+    seen.add(path)
+    with open(path, encoding="utf-8") as f :
+        tree = ast.parse(f.read())
+    for node in ast.walk(tree) :
+        if isinstance(node, ast.Import) :
+            names = [a.name for a in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module :
+            names = [node.module]
+        else :
+            continue
+        for name in names :
+            code_files(name.split(".")[0] + ".py", seen)
+    if script == "ML_model.py" :
+        for (module, classname) in BACKENDS.values() :
+            code_files(module + ".py", seen)
+    return seen
+
+
+## --
+## -- A pipeline stage: runs 'cmd' (a script in CODEDIR plus arguments,
+## -- or a python function) reading 'stdin' and writing 'stdout', after
+## -- all stages in 'deps' are done.
+## --
+
+class Stage :
+
+    def __init__(self, name, cmd, inputs=[], outputs=[], deps=[], stdin=None, stdout=None) :
+        self.name = name
+        self.cmd = cmd
+        self.inputs = inputs
+        self.outputs = outputs + ([stdout] if stdout else [])
+        self.deps = deps
+        self.stdin = stdin
+        self.stdout = stdout
+
+    def fingerprint(self) :
+        h = hashlib.sha1()
+        if callable(self.cmd) :
+            h.update(self.cmd.__name__.encode())
+            h.update(file_hash(os.path.abspath(__file__)).encode())
+        else :
+            h.update(json.dumps(self.cmd).encode())
+            for f in sorted(code_files(self.cmd[0])) :
+                h.update((f + ":" + file_hash(f) + "\n").encode())
+        for f in self.inputs + ([self.stdin] if self.stdin else []) :
+            h.update((f + ":" + path_hash(f) + "\n").encode())
+        return h.hexdigest()
+
+    def stampfile(self) :
+        return os.path.join(STAMPDIR, self.name + ".stamp")
+
+    def up_to_date(self, fp) :
+        if not all(os.path.exists(f) for f in self.outputs) : return False
+        try :
+            with open(self.stampfile()) as f :
+                return f.read().strip() == fp
+        except OSError :
+            return False
+
+    def run(self, force) :
+        fp = self.fingerprint()
+        if not force and self.up_to_date(fp) :
+            return "cached"
+
+        if os.path.exists(self.stampfile()) : os.remove(self.stampfile())
+        try :
+            if callable(self.cmd) :
+                self.cmd(self)
+            else :
+                fin = open(self.stdin, "rb") if self.stdin else None
+                fout = open(self.stdout, "wb") if self.stdout else None
+                try :
+                    subprocess.run([sys.executable, os.path.join(CODEDIR, self.cmd[0])] + self.cmd[1:],
+                                   stdin=fin, stdout=fout, check=True)
+                finally :
+                    if fin : fin.close()
+                    if fout : fout.close()
+        except BaseException :
+            # do not leave partial outputs behind
+            for f in self.outputs :
+                if os.path.exists(f) : os.remove(f)
+            raise
+
+        with open(self.stampfile(), "w") as f :
+            f.write(fp + "\n")
+        return "done"
+
+
+## --
+## -- Token lines of a feature file, without the first four fields and
+## -- blank lines (as "cut -f5- | grep -v ^$" in run.sh).  Files may be
+## -- compressed (see compressed.py)
+## --
+
+def classification_features(stage) :
+    with io.TextIOWrapper(open_input(stage.stdin), encoding="utf-8") as fin, open_text_output(stage.stdout) as fout :
+        for line in fin :
+            if line.strip() :
+                fout.write(line.split("\t", 4)[4])
+
+
+## --
+## -- Build the stages for given options
+## --
+
+def build_pipeline(args) :
+    data = os.path.join(args.basedir, "data")
+    drugbank = os.path.join(args.basedir, "resources", "DrugBank.txt")
+    split = args.split
+    stages = []
+
+    # intermediate files are compressed with --compress, if given
+    (compress, ext) = (["--compress", args.compress], CODECS[args.compress][1]) if args.compress else ([], "")
+
+    def extract(name) :
+        return Stage("extract-"+name, ["extract-features.py", "--tokenizer", args.tokenizer,
+                                       "--workers", str(args.workers)] + compress + [os.path.join(data, name)],
+                     inputs=[os.path.join(data, name), drugbank], stdout=name+".feat"+ext)
+
+    def evaluate(model, out) :
+        return Stage("evaluate-"+model, ["evaluator.py", "NER", os.path.join(data, split), out],
+                     inputs=[os.path.join(data, split), out], deps=["predict-"+model],
+                     stdout=out[:-len(".out"+ext)]+".stats")
+
+    stages.append(extract("train"))
+    stages.append(extract(split))
+
+    if "crf" in args.models :
+        stages.append(Stage("train-crf", ["train-crf.py", "model.crf"], stdin="train.feat"+ext,
+                            outputs=["model.crf"], deps=["extract-train"]))
+        stages.append(Stage("predict-crf", ["predict.py", "--workers", str(args.workers)] + compress + ["model.crf"],
+                            inputs=["model.crf"], stdin=split+".feat"+ext, stdout=split+"-CRF.out"+ext,
+                            deps=["train-crf", "extract-"+split]))
+        stages.append(evaluate("crf", split+"-CRF.out"+ext))
+
+    if "nb" in args.models :
+        stages.append(Stage("clf-features", classification_features, stdin="train.feat"+ext,
+                            stdout="train.clf.feat"+ext, deps=["extract-train"]))
+        stages.append(Stage("train-nb", ["train-sklearn.py", "model.joblib", "vectorizer.joblib"],
+                            stdin="train.clf.feat"+ext, outputs=["model.joblib", "vectorizer.joblib"],
+                            deps=["clf-features"]))
+        stages.append(Stage("predict-nb", ["predict-sklearn.py"] + compress + ["model.joblib", "vectorizer.joblib"],
+                            inputs=["model.joblib", "vectorizer.joblib"], stdin=split+".feat"+ext,
+                            stdout=split+"-NB.out"+ext, deps=["train-nb", "extract-"+split]))
+        stages.append(evaluate("nb", split+"-NB.out"+ext))
+
+    return stages
+
+
+## --
+## -- Run stages in dependency order, running concurrently those whose
+## -- dependencies are done.  Returns False if some stage failed.
+## --
+
+def run_pipeline(stages, jobs, force) :
+    pending = { s.name : s for s in stages }
+    done = set()
+    running = {}
+    failed = False
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool :
+        while pending or running :
+            if not failed :
+                for name in list(pending) :
+                    s = pending[name]
+                    if all(d in done for d in s.deps) :
+                        print("[start]  ", name, file=sys.stderr)
+                        running[pool.submit(s.run, force)] = s
+                        del pending[name]
+
+            if not running : break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished :
+                s = running.pop(fut)
+                try :
+                    print(("["+fut.result()+"]").ljust(9), s.name, file=sys.stderr)
+                    done.add(s.name)
+                except Exception as e :
+                    print("[FAILED] ", s.name, ":", e, file=sys.stderr)
+                    failed = True
+
+    return not failed
+
+
+## --------- MAIN PROGRAM -----------
+## --
+## -- Usage:  run-pipeline.py [--basedir DIR] [--split devel|test] [--models crf,nb]
+## --                         [--jobs J] [--workers N] [--compress gzip|zstd|lz4] [--force]
+## --
+## -- Runs the pipeline in the current directory, redoing only stages
+## -- whose inputs or code changed since their last run.
+## -- With --compress, feature files and outputs are written compressed
+## -- (e.g. train.feat.gz), and read back as they are decompressed.
+## --
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--basedir", default="../lab1/DDI/", help="DDI directory, with data/ and resources/")
+    parser.add_argument("--split", default="devel", help="data split to predict and evaluate")
+    parser.add_argument("--models", default="crf,nb", help="comma separated models to run (crf,nb)")
+    parser.add_argument("--tokenizer", default="nltk", help="tokenizer for feature extraction")
+    parser.add_argument("--jobs", type=int, default=2, help="stages to run concurrently")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes for extraction and CRF tagging")
+    parser.add_argument("--compress", choices=sorted(CODECS), help="compress intermediate files")
+    parser.add_argument("--force", action="store_true", help="rerun all stages")
+    args = parser.parse_args()
+    args.models = args.models.split(",")
+
+    os.makedirs(STAMPDIR, exist_ok=True)
+    ok = run_pipeline(build_pipeline(args), args.jobs, args.force)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,56 @@
+#####################################################
+## Sentence tokenizers returning (word,start,end) triples
+#####################################################
+
+import re
+
+## --------- NLTK tokenizer ----------- 
+## -- Tokenize sentence with nltk word_tokenize, returning tokens and span offsets
+
+def tokenize_nltk(txt):
+    from nltk.tokenize import word_tokenize
+
+    offset = 0
+    tks = []
+    ## word_tokenize splits words, taking into account punctuations, numbers, etc.
+    for t in word_tokenize(txt):
+        ## keep track of the position where each token should appear, and
+        ## store that information with the token
+        start = txt.find(t, offset)
+        if start == -1 and t in ("``", "''"):
+            ## word_tokenize rewrites double quotes as `` or '', recover
+            ## the original character
+            t = '"'
+            start = txt.find(t, offset)
+        offset = start
+        tks.append((t, offset, offset+len(t)-1))
+        offset += len(t)
+
+    ## tks is a list of triples (word,start,end)
+    return tks
+
+
+## --------- regex tokenizer ----------- 
+## -- Tokenize sentence with a single compiled regular expression, 
+## -- obtaining span offsets directly from the matches
+
+TOKEN_RE = re.compile(r"""
+      \d+(?:[.,]\d+)+              # numbers with decimals: 2.5, 1,000
+    | \w+(?:[-/.]\w+)*             # words, possibly with inner - / . (ABT-737, mg/kg)
+    | '(?:s|re|ve|ll|d|m)\b        # clitics, split as word_tokenize does
+    | \.\.\.|--                    # multi-character punctuation
+    | [^\w\s]                      # any other symbol, one by one
+    """, re.VERBOSE | re.IGNORECASE)
+
+def tokenize_regex(txt):
+    return [(m.group(), m.start(), m.end()-1) for m in TOKEN_RE.finditer(txt)]
+
+
+## --
+## -- Available tokenizers, by name
+## --
+
+TOKENIZERS = { "nltk" : tokenize_nltk, "regex" : tokenize_regex }
+
+def tokenize(txt, method="nltk"):
+    return TOKENIZERS[method](txt)
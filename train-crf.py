@@ -2,57 +2,242 @@
 
 import pycrfsuite
 import sys
+import os
+import json
+import math
+import random
+import shutil
+import argparse
+import tempfile
+from itertools import product
+from multiprocessing import Pool
 from contextlib import redirect_stdout
 
-def instances(fi):
-    xseq = []
-    yseq = []
-    
-    for line in fi:
-        line = line.strip('\n')
-        if not line:
-            # An empty line means the end of a sentence.
-            # Return accumulated sequences, and reinitialize.
-            yield xseq, yseq
-            xseq = []
-            yseq = []
-            continue
-
-        # Split the line with TAB characters.
-        fields = line.split('\t')
-        
-        # Append the item features to the item sequence.
-        # fields are:  0=sid, 1=form, 2=span_start, 3=span_end, 4=tag, 5...N = features
-        item = fields[5:]        
-        xseq.append(item)
-        
-        # Append the label to the label sequence.
-        yseq.append(fields[4])
+import featfile
+import features
+import CRF
+from ML_model import decode
+from evaluator import Evaluator
 
+def instances(fi, select=None):
+    # fi is a binary stream with a feature file, in text or binary format.
+    # select, if given, filters the features of each sentence (see
+    # features.group_filter)
+    for toks, tags, xseq in featfile.instances(fi):
+        yield (select(xseq) if select else xseq), tags
+
+
+## --
+## -- Hyperparameter search
+## --
+
+# parameters understood by each training algorithm (besides feature.*)
+ALGORITHM_PARAMS = { "lbfgs" : ["c1", "c2", "max_iterations"],
+                     "l2sgd" : ["c2", "max_iterations"],
+                     "ap" : ["max_iterations"],
+                     "pa" : ["c", "max_iterations"],
+                     "arow" : ["variance", "gamma", "max_iterations"] }
+
+def applies(param, algorithm):
+    return param.startswith("feature.") or param in ALGORITHM_PARAMS[algorithm]
+
+## --
+## -- Candidate (algorithm, params) settings from a search space, e.g.
+## --    {"algorithm": ["l2sgd","lbfgs"], "c1": [0, 0.1], "c2": [0.01, 0.1, 1],
+## --     "feature.minfreq": [1, 2]}
+## -- Each value is a list of choices, or a range {"min": a, "max": b, "log": true}
+## -- (only for random search).  With nrandom=0 the whole grid is returned,
+## -- otherwise nrandom settings are sampled.  Parameters that do not apply
+## -- to an algorithm are ignored for it.  Raises ValueError for specs
+## -- that are neither, empty lists, ranges in a grid search, unknown
+## -- algorithms, or a space with no candidates.
+## --
+
+def candidates(space, nrandom, seed):
+    if not isinstance(space, dict):
+        raise ValueError("Search space must be a JSON object of parameter -> values")
+    algorithms = space.get("algorithm", ["l2sgd"])
+    names = sorted(k for k in space if k != "algorithm")
+    found = []
+
+    if not isinstance(algorithms, list) or not algorithms:
+        raise ValueError("'algorithm' must be a non-empty list of algorithms")
+    for alg in algorithms:
+        if alg not in ALGORITHM_PARAMS:
+            raise ValueError("Unknown algorithm '"+str(alg)+"', use one of "+", ".join(sorted(ALGORITHM_PARAMS)))
+    for k in names:
+        spec = space[k]
+        if isinstance(spec, dict) and "min" in spec and "max" in spec:
+            if nrandom == 0:
+                raise ValueError("Range for '"+k+"' needs random search (--random N), or give a list of values")
+        elif not isinstance(spec, list):
+            raise ValueError("Value of '"+k+"' must be a list of choices, or a range {\"min\": a, \"max\": b}")
+        elif not spec:
+            raise ValueError("No values to try for '"+k+"'")
+
+    if nrandom == 0:
+        for alg in algorithms:
+            keys = [k for k in names if applies(k, alg)]
+            for values in product(*[space[k] for k in keys]):
+                found.append((alg, dict(zip(keys, values))))
+    else:
+        rng = random.Random(seed)
+        def sample(spec):
+            if isinstance(spec, list): return rng.choice(spec)
+            if spec.get("log"): return math.exp(rng.uniform(math.log(spec["min"]), math.log(spec["max"])))
+            return rng.uniform(spec["min"], spec["max"])
+        for i in range(nrandom):
+            alg = rng.choice(algorithms)
+            found.append((alg, { k : sample(space[k]) for k in names if applies(k, alg) }))
+
+    # remove duplicates (e.g. grid values of parameters ignored by an algorithm)
+    unique = []
+    for c in found:
+        if c not in unique: unique.append(c)
+    if not unique:
+        raise ValueError("The search space gives no candidate settings")
+    return unique
+
+
+# training and devel data, shared by all candidates in a worker process
+train_data = None
+devel_data = None
+evaluator = None
+
+def init_worker(train, devel, ev):
+    global train_data, devel_data, evaluator
+    (train_data, devel_data, evaluator) = (train, devel, ev)
+
+## --
+## -- Train a model for one candidate setting, tag devel with it, and
+## -- score the predictions in memory.
+## --
+
+def evaluate_candidate(job):
+    (i, algorithm, params, modelfile) = job
+    CRF.train(train_data, modelfile, algorithm, params)
+
+    tagger = CRF.CRF(modelfile)
+    predicted = [e for xseq, toks in devel_data for e in decode(toks, tagger.predict(xseq))]
+    stats = evaluator.score(predicted)
+    return (i, algorithm, params, { "P" : stats["m.avg"]["P"], "R" : stats["m.avg"]["R"],
+                                    "microF1" : stats["m.avg"]["F1"], "macroF1" : stats["M.avg"]["F1"] })
+
+
+def search(args):
+    try:
+        if os.path.exists(args.search):
+            with open(args.search) as f: space = json.load(f)
+        else:
+            space = json.loads(args.search)
+    except json.JSONDecodeError as e:
+        sys.exit("Search space is neither a file nor valid JSON: "+args.search+" ("+str(e)+")")
+    try:
+        cands = candidates(space, args.random, args.seed)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    # load data once
+    select = features.group_filter(args.groups, args.exclude_groups)
+    train = list(instances(sys.stdin.buffer, select))
+    with open(args.devel, "rb") as f:
+        devel = [(select(xseq) if select else xseq, toks) for toks, tags, xseq in featfile.instances(f)]
+    ev = Evaluator("NER", args.gold, args.gold_cache)
+
+    tmpdir = tempfile.mkdtemp(prefix="crfsearch")
+    try:
+        jobs = [(i, alg, params, os.path.join(tmpdir, "cand%d.crf" % i)) for i, (alg, params) in enumerate(cands)]
+        with Pool(args.workers, initializer=init_worker, initargs=(train, devel, ev)) as pool:
+            results = []
+            for r in pool.imap_unordered(evaluate_candidate, jobs):
+                print("done", r[1], json.dumps(r[2]), "{:2.1%}".format(r[3][args.metric]), file=sys.stderr)
+                results.append(r)
+
+        # leaderboard, best first
+        results.sort(key=lambda r: (-r[3][args.metric], r[0]))
+        print("rank\talgorithm\tP\tR\tm.F1\tM.F1\tparameters")
+        for rank, (i, alg, params, sc) in enumerate(results):
+            print("{}\t{}\t{:2.1%}\t{:2.1%}\t{:2.1%}\t{:2.1%}\t{}".format(rank+1, alg, sc["P"], sc["R"], sc["microF1"], sc["macroF1"], json.dumps(params)))
+
+        # keep the best model
+        shutil.copy(jobs[results[0][0]][3], args.modelfile)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+## --
+## -- Usage:  train-crf.py [--algorithm A] [--c1 C1] [--c2 C2] [--minfreq F]
+## --                     [--groups G,...] [--exclude-groups G,...] model < train.feat
+## --         train-crf.py --search SPACE --devel devel.feat --gold golddir [--gold-cache DIR]
+## --                      [--random N] [--workers W] model < train.feat
+## --
+## -- In search mode, SPACE is a JSON file or string with the values to
+## -- try for the algorithm and its parameters (see candidates()).  A model
+## -- is trained for each setting in a pool of W processes, and scored on
+## -- devel.  A leaderboard is printed, and the best model is kept.
+## -- --gold-cache DIR keeps the gold set of golddir in DIR, so that
+## -- repeated sweeps skip parsing it (see evaluator.load_gold).
+## -- --groups G1,G2... keeps only the features of the given groups,
+## -- --exclude-groups G1,G2... removes those of the given groups (see
+## -- GROUPS in features.py), so that feature groups can be compared
+## -- with a single extraction (extract-features.py --all-groups)
+## --
 
 if __name__ == '__main__':
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modelfile", help="file where model will be written")
+    parser.add_argument("--algorithm", default="l2sgd", choices=["l2sgd", "lbfgs"], help="training algorithm")
+    parser.add_argument("--c1", type=float, help="coefficient for L1 regularization (lbfgs only)")
+    parser.add_argument("--c2", type=float, default=0.1, help="coefficient for L2 regularization")
+    parser.add_argument("--minfreq", type=float, default=1, help="minimum frequency of a feature to consider it")
+    parser.add_argument("--search", help="search space (JSON file or string)")
+    parser.add_argument("--devel", help="devel feature file, to score candidates in search mode")
+    parser.add_argument("--gold", help="devel gold XML directory, to score candidates in search mode")
+    parser.add_argument("--gold-cache", help="directory to keep the loaded gold set in, for later searches")
+    parser.add_argument("--random", type=int, default=0, help="number of random candidates (default: whole grid)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for random search")
+    parser.add_argument("--metric", default="microF1", choices=["microF1", "macroF1"], help="metric to rank candidates")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes in search mode")
+    parser.add_argument("--groups", help="comma separated feature groups to use (default: all in the input)")
+    parser.add_argument("--exclude-groups", help="comma separated feature groups to leave out")
+    args = parser.parse_args()
+    try:
+        select = features.group_filter(args.groups, args.exclude_groups)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.c1 is not None and args.algorithm != "lbfgs":
+        parser.error("--c1 needs --algorithm lbfgs")
+
+    if args.search:
+        if not (args.devel and args.gold):
+            parser.error("--search needs --devel and --gold")
+        search(args)
+        sys.exit()
+
     # get file where model will be written
-    modelfile = sys.argv[1]
-    
+    modelfile = args.modelfile
+
     # Create a Trainer object.
     trainer = pycrfsuite.Trainer()
-    
+
     # Read training instances from STDIN, and append them to the trainer.
-    for xseq, yseq in instances(sys.stdin):
+    for xseq, yseq in instances(sys.stdin.buffer, select):
         trainer.append(xseq, yseq, 0)
 
-    # Use L2-regularized SGD and 1st-order dyad features.
-    trainer.select('l2sgd', 'crf1d')
-    
-    # This demonstrates how to list parameters and obtain their values.    
-    trainer.set('feature.minfreq', 1) # mininum frequecy of a feature to consider it
-    trainer.set('c2', 0.1)           # coefficient for L2 regularization
+    # Use given algorithm (default: L2-regularized SGD) and 1st-order dyad features.
+    trainer.select(args.algorithm, 'crf1d')
+
+    # This demonstrates how to list parameters and obtain their values.
+    trainer.set('feature.minfreq', args.minfreq) # mininum frequecy of a feature to consider it
+    if args.c1 is not None :
+        trainer.set('c1', args.c1)           # coefficient for L1 regularization
+    trainer.set('c2', args.c2)           # coefficient for L2 regularization
 
     print("Training with following parameters: ")
     for name in trainer.params():
         print (name, trainer.get(name), trainer.help(name), file=sys.stderr)
-        
+
     # Start training and dump model to modelfile
     trainer.train(modelfile, -1)
-
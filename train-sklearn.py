@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
 import sys
-from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_extraction import DictVectorizer, FeatureHasher
 from sklearn.naive_bayes import MultinomialNB
 import numpy as np
 import argparse
 from joblib import dump
+import featfile
+import compressed
+import features
 
 
+# BIO tags for the DDI entity types
+TAGS = ['O', 'B-drug', 'I-drug', 'B-drug_n', 'I-drug_n', 'B-brand', 'I-brand', 'B-group', 'I-group']
+
 
 def fix_format(token):
 	if 'BoS' in token:
@@ -17,11 +23,16 @@ def fix_format(token):
 	return token
 
 
-def load_data(data):
+def load_data(data, select=None):
+	# select, if given, filters the features of each token
+	# (see features.group_filter)
 	features = []
 	labels = []
 	for token in data:
 		token = token.strip()
+		if select:
+			fields = token.split('\t')
+			token = '\t'.join(fields[:1] + select([fields[1:]])[0])
 		token = fix_format(token).split('\t')
 		token_dict = {feat.split('=')[0]:feat.split('=')[1] for feat in token[1:]}
 		features.append(token_dict)
@@ -29,33 +40,124 @@ def load_data(data):
 	return features, labels
 
 
-if __name__ == '__main__':
-
-	model_file = sys.argv[1]
-	vectorizer_file = sys.argv[2] 	
-
-	train_features, y_train = load_data(sys.stdin)
-	y_train = np.asarray(y_train)
-	classes = np.unique(y_train)
-
-	v = DictVectorizer()
-	X_train = v.fit_transform(train_features)
+def chunks(data, size):
+	# split token lines in lists of at most 'size' tokens
+	chunk = []
+	for token in data:
+		chunk.append(token)
+		if len(chunk) == size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+
+def vocabulary(fi):
+	# one {name: value} dict per feature of a vocabulary file (one
+	# name=value feature per line), expanded as load_data does
+	for line in fi:
+		for feat in fix_format(line.strip()).split('\t'):
+			if '=' in feat:
+				yield {feat.split('=')[0]:feat.split('=')[1]}
+
+
+def binary_tokens(fi):
+	# one tag+features line per token, as in text input
+	for toks, tags, xseq in featfile.read_binary(fi):
+		for tag, feats in zip(tags, xseq):
+			yield '\t'.join([tag]+feats)
+
+
+## --
+## -- Usage:  train-sklearn.py [--chunk-size N [--vocabulary FILE | --n-features F]]
+## --                          [--alpha A] [--groups G,...] [--exclude-groups G,...]
+## --                          model_file vectorizer_file < features
+## --
+## -- By default, all tokens are loaded and vectorized with a DictVectorizer.
+## -- With --chunk-size N, tokens are read N at a time and the model is
+## -- updated with partial_fit on each chunk, in a feature space fixed
+## -- in advance:
+## --   --vocabulary FILE: a DictVectorizer over the features listed in FILE,
+## --       one per line, e.g. made with
+## --          cut -f2- train.clf.feat | tr '\t' '\n' | sort -u > vocabulary.txt
+## --       Features not in FILE are ignored.  Same model as the default.
+## --   otherwise, a FeatureHasher with F buckets (default 2**18).  The
+## --       smoothing (A for each bucket of each tag) of empty buckets
+## --       outweighs real counts when F is much larger than the number of
+## --       features in the data: a warning is printed after training then.
+## --       The model keeps two float64 arrays of tags x F values (38 MB
+## --       for 2**18 and the 9 BIO tags).
+## -- --groups/--exclude-groups keep only some feature groups of the input
+## -- (see train-crf.py). Use the same groups with predict-sklearn.py.
+## --
 
-	clf = MultinomialNB(alpha=0.01)
-	clf.partial_fit(X_train, y_train, classes)
+if __name__ == '__main__':
 
-	#Save classifier and DictVectorizer
+	parser = argparse.ArgumentParser()
+	parser.add_argument("model_file", help="file where the model will be written")
+	parser.add_argument("vectorizer_file", help="file where the vectorizer will be written")
+	parser.add_argument("--chunk-size", type=int, default=0, help="train in chunks of this many tokens, with hashed features")
+	parser.add_argument("--vocabulary", help="with --chunk-size, file with all features (one per line) to use instead of hashing")
+	parser.add_argument("--n-features", type=int, default=2**18, help="size of the hashed feature space (the model takes 16 bytes per tag and feature)")
+	parser.add_argument("--alpha", type=float, default=0.01, help="additive smoothing of the Naive Bayes model")
+	parser.add_argument("--classes", default=",".join(TAGS), help="comma separated list of all tags (needed with --chunk-size)")
+	parser.add_argument("--groups", help="comma separated feature groups to use (default: all in the input)")
+	parser.add_argument("--exclude-groups", help="comma separated feature groups to leave out")
+	args = parser.parse_args()
+	try:
+		select = features.group_filter(args.groups, args.exclude_groups)
+	except ValueError as e:
+		parser.error(str(e))
+	if args.vocabulary and not args.chunk_size:
+		parser.error("--vocabulary needs --chunk-size")
+
+	model_file = args.model_file
+	vectorizer_file = args.vectorizer_file
+
+	# input is either the tag+features lines of a text feature file 
+	# (cut -f5-), or a whole binary feature file, possibly compressed
+	stdin = compressed.reader(sys.stdin.buffer)
+	head = stdin.read(len(featfile.MAGIC))
+	if head == featfile.MAGIC:
+		data = binary_tokens(stdin)
+	else:
+		data = (line.decode('utf-8') for line in featfile.text_lines(head, stdin))
+
+	if args.chunk_size:
+		# out-of-core training: the feature space (given vocabulary, or
+		# hashed) needs no fitting on the data, so the model can be
+		# updated chunk by chunk, with bounded memory
+		classes = np.asarray(args.classes.split(','))
+		if args.vocabulary:
+			v = DictVectorizer()
+			with open(args.vocabulary, encoding='utf-8') as f:
+				v.fit(vocabulary(f))
+		else:
+			v = FeatureHasher(n_features=args.n_features, input_type='dict', alternate_sign=False)
+		clf = MultinomialNB(alpha=args.alpha)
+		data = (token for token in data if token.strip())
+		for chunk in chunks(data, args.chunk_size):
+			train_features, y_train = load_data(chunk, select)
+			clf.partial_fit(v.transform(train_features), np.asarray(y_train), classes)
+
+		if not args.vocabulary:
+			used = int(np.count_nonzero(clf.feature_count_.sum(axis=0)))
+			if args.n_features > 4*used:
+				print("Warning: only {} of {} hashed features are used, and the smoothing of the empty ones "
+				      "may drown the counts of rare tags.  Use --n-features {} or --vocabulary"
+				      .format(used, args.n_features, 1 << (2*used).bit_length()), file=sys.stderr)
+
+	else:
+		train_features, y_train = load_data(data, select)
+		y_train = np.asarray(y_train)
+		classes = np.unique(y_train)
+
+		v = DictVectorizer()
+		X_train = v.fit_transform(train_features)
+
+		clf = MultinomialNB(alpha=args.alpha)
+		clf.partial_fit(X_train, y_train, classes)
+
+	#Save classifier and DictVectorizer (or FeatureHasher)
 	dump(clf, model_file) 
 	dump(v, vectorizer_file)
-
-	 
-
-
-
-
-
-
-		
-
-
-	 